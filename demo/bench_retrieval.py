@@ -0,0 +1,173 @@
+"""离线检索基准测试
+
+用确定性的hash embedding代替gemini接口，在不同规模的合成语料上对比各检索后端的
+建库吞吐、查询延迟p50/p99、recall@k和内存占用，不需要网络和api key。
+
+用法: python bench_retrieval.py [--sizes 1000 5000] [--queries 200] [--k 5]
+"""
+import argparse
+import contextlib
+import hashlib
+import io
+import os
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import embeding
+from bm25 import tokenize
+from embed_cache import EmbeddingCache
+from vector_index import VectorIndex, NumpyIndex, ChromaIndex
+
+# ================== 确定性本地embedding ==================
+class HashEmbedder:
+    """特征hash：每个词项hash到一个维度和正负号，累加后归一化；同样的文本永远得到同样的向量"""
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def embed(self, text: str) -> list[float]:
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for term in tokenize(text):
+            h = int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+            vec[h % self.dim] += 1.0 if (h >> 32) & 1 else -1.0
+        norm = np.linalg.norm(vec)
+        return (vec / norm if norm else vec).tolist()
+
+    def __call__(self, texts: list[str], task_type: str) -> list[list[float]]:
+        return [self.embed(t) for t in texts]
+
+# ================== 合成语料 ==================
+def make_corpus(size: int, seed: int = 0) -> list[tuple[str, str]]:
+    """生成size篇短文档，每篇带一个唯一的学号作为标准答案，返回[(学号, 文本)]"""
+    rng = random.Random(seed)
+    vocab = [f"w{i}" for i in range(5000)]
+    weights = [1 / (i + 1) for i in range(len(vocab))]  # Zipf分布，和真实文本的词频接近
+    docs = []
+    for i in range(size):
+        key = f"S{seed}{i:07d}"
+        words = rng.choices(vocab, weights=weights, k=40)
+        docs.append((key, f"学号 {key} " + " ".join(words)))
+    return docs
+
+def make_queries(docs: list[tuple[str, str]], n: int, seed: int = 1) -> list[tuple[str, str]]:
+    """一半是只含学号的精确查询，一半是从文档中抽几个词的模糊查询"""
+    rng = random.Random(seed)
+    queries = []
+    for j in range(n):
+        key, text = rng.choice(docs)
+        if j % 2 == 0:
+            queries.append((key, key))
+        else:
+            words = text.split()[2:]
+            queries.append((key, " ".join(rng.sample(words, 6))))
+    return queries
+
+# 每篇文档单独成一个chunk（每段都是切分点、不留重叠），语料规模和recall@k都按文档计，
+# 否则默认的512 token预算会把约10篇短文档合成一个chunk
+BENCH_CHUNKING = {"overlap_tokens": 0, "target_tokens": 1}
+
+def write_corpus(docs: list[tuple[str, str]], root: str, per_file: int = 1000):
+    """按每个文件per_file篇写成多个md文件，段落之间空行分隔"""
+    os.makedirs(root, exist_ok=True)
+    for n, start in enumerate(range(0, len(docs), per_file)):
+        with open(os.path.join(root, f"part{n:04d}.md"), "w", encoding="utf-8") as f:
+            f.write("\n\n".join(text for _, text in docs[start:start + per_file]))
+
+# ================== 测量 ==================
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+def dir_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+
+BACKENDS = {
+    "numpy-float32": lambda path: NumpyIndex(path, dtype="float32"),
+    "numpy-float16": lambda path: NumpyIndex(path, dtype="float16"),
+    "numpy-int8": lambda path: NumpyIndex(path, dtype="int8"),
+    "chroma": lambda path: ChromaIndex(path, collection="bench"),
+}
+MODES = ("vector", "keyword", "hybrid", "auto")
+
+def bench_backend(name: str, corpus_root: str, work_dir: str, queries, k: int) -> list[dict]:
+    index_path = os.path.join(work_dir, name)
+    embeding.vector_index = BACKENDS[name](index_path)
+    embeding.embedding_cache = EmbeddingCache(os.path.join(work_dir, f"{name}_cache.db"))
+    embeding.reset_bm25()
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        embeding.create_db(corpus_root, **BENCH_CHUNKING)
+    ingest_seconds = time.perf_counter() - start
+    chunks = len(embeding.vector_index.ids())
+
+    # 重新打开索引，测量加载 + 建BM25 + 首次查询的Python堆内存和启动时间
+    tracemalloc.start()
+    start = time.perf_counter()
+    index: VectorIndex = BACKENDS[name](index_path)
+    embeding.reset_bm25()
+    embeding.query_db(queries[0][1], k, index, mode="hybrid")
+    startup_seconds = time.perf_counter() - start
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    rows = []
+    for mode in MODES:
+        latencies, hits = [], 0
+        for key, query in queries:
+            t0 = time.perf_counter()
+            docs = embeding.query_db(query, k, index, mode=mode)
+            latencies.append(time.perf_counter() - t0)
+            hits += any(key in d for d in docs)
+        rows.append({
+            "backend": name,
+            "mode": mode,
+            "chunks": chunks,
+            "ingest_chunks_per_s": chunks / ingest_seconds,
+            "startup_ms": startup_seconds * 1000,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            f"recall@{k}": hits / len(queries),
+            "py_heap_mb": peak_memory / 2**20,
+            "disk_mb": dir_size(index_path) / 2**20,
+        })
+    return rows
+
+def print_rows(rows: list[dict]):
+    headers = list(rows[0].keys())
+    print(" | ".join(headers))
+    for row in rows:
+        print(" | ".join(f"{v:.3f}" if isinstance(v, float) else str(v) for v in row.values()))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 20000], help="合成语料的文档数")
+    parser.add_argument("--queries", type=int, default=200, help="每个后端的查询数")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument("--dim", type=int, default=256, help="hash embedding的维度")
+    args = parser.parse_args()
+
+    embeding.local_embedder = HashEmbedder(args.dim)
+    for size in args.sizes:
+        print(f"\n========== 语料规模 {size} ==========")
+        docs = make_corpus(size)
+        queries = make_queries(docs, args.queries)
+        work_dir = tempfile.mkdtemp(prefix="bench_retrieval_")
+        try:
+            corpus_root = os.path.join(work_dir, "corpus")
+            write_corpus(docs, corpus_root)
+            rows = []
+            for name in args.backends:
+                rows.extend(bench_backend(name, corpus_root, work_dir, queries, args.k))
+            print_rows(rows)
+        finally:
+            embeding.vector_index = None
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
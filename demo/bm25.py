@@ -0,0 +1,77 @@
+import math
+import re
+from collections import Counter, defaultdict
+
+# 英文/数字按整词，中文连续片段按相邻两字切分（单字片段保留单字），学号、课程号、姓名都能精确命中
+WORD_PATTERN = re.compile(r'[\u3400-\u9fff\uf900-\ufaff]+|[0-9A-Za-z_]+')
+CJK_PATTERN = re.compile(r'[\u3400-\u9fff\uf900-\ufaff]')
+
+def tokenize(text: str) -> list[str]:
+    tokens = []
+    for m in WORD_PATTERN.finditer(text):
+        word = m.group()
+        if CJK_PATTERN.match(word):
+            if len(word) == 1:
+                tokens.append(word)
+            else:
+                tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            tokens.append(word.lower())
+    return tokens
+
+# ================== BM25 倒排索引 ==================
+class BM25Index:
+    def __init__(self, ids: list[str], documents: list[str], k1: float = 1.5, b: float = 0.75):
+        self.ids = ids
+        self.documents = documents
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list)  # term -> [(文档序号, 词频)]
+        self.doc_len = []
+        for i, doc in enumerate(documents):
+            counts = Counter(tokenize(doc))
+            self.doc_len.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self.postings[term].append((i, tf))
+        self.avgdl = sum(self.doc_len) / len(self.doc_len) if self.doc_len else 0.0
+        n = len(documents)
+        self.idf = {t: math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5)) for t, p in self.postings.items()}
+
+    def __len__(self):
+        return len(self.documents)
+
+    def search(self, query: str, n_results: int = 5) -> list[tuple[int, float]]:
+        """返回按分数降序的(文档序号, 分数)"""
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for i, tf in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_len[i] / self.avgdl)
+                scores[i] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda x: x[1], reverse=True)[:n_results]
+
+    def confidence(self, query: str, hits: list[tuple[int, float]]) -> float:
+        """词法置信度：top1文档覆盖的查询词idf占比，再按与top2的分差打折；0~1"""
+        if not hits:
+            return 0.0
+        terms = {t for t in tokenize(query) if t in self.idf}
+        query_idf = sum(self.idf.get(t, 0.0) for t in set(tokenize(query)))
+        if not terms or query_idf == 0:
+            return 0.0
+        top_terms = set(tokenize(self.documents[hits[0][0]]))
+        coverage = sum(self.idf[t] for t in terms if t in top_terms) / query_idf
+        if len(hits) == 1:
+            return coverage
+        margin = 1 - hits[1][1] / hits[0][1]
+        return coverage * min(1.0, 0.5 + margin)
+
+def rrf_fuse(rankings: list[list[str]], n_results: int = 5, k: int = 60) -> list[str]:
+    """Reciprocal Rank Fusion：不需要对BM25分数和向量相似度做归一化就能合并多路排序"""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            scores[doc] += 1 / (k + rank + 1)
+    return [doc for doc, _ in sorted(scores.items(), key=lambda x: x[1], reverse=True)[:n_results]]
+
@@ -1,13 +1,132 @@
-def read_data() -> str:
-    with open('do.md', 'r',encoding="utf-8") as file:
-        return file.read()
+import hashlib
+import os
+import re
+from typing import Iterator
+from pydantic import BaseModel, Field
 
-def get_chunks() -> list[str]:
-    data = read_data()
-    return data.split('\n\n')
+DATA_PATH = 'do.md'
+DATA_EXTENSIONS = ('.md', '.txt')
+MAX_TOKENS = 512     # 每个chunk的token预算
+OVERLAP_TOKENS = 64  # 相邻chunk之间重叠的token数
+TARGET_TOKENS = 256  # chunk的平均token数，决定内容切分点的密度
+
+# 粗略的token切分：一个汉字/一个英文单词/一个标点各算一个token
+TOKEN_PATTERN = re.compile(r'[\u3400-\u9fff\uf900-\ufaff]|\w+|[^\w\s]')
+
+class Chunk(BaseModel):
+    text: str = Field(description="chunk文本")
+    source: str = Field(description="来源文件路径")
+    start: int = Field(description="在来源文件中的起始字符偏移")
+    end: int = Field(description="在来源文件中的结束字符偏移")
+    index: int = Field(description="在来源文件中的序号")
+
+    def metadata(self) -> dict:
+        return {"source": self.source, "start": self.start, "end": self.end, "index": self.index}
+
+def count_tokens(text: str) -> int:
+    return sum(1 for _ in TOKEN_PATTERN.finditer(text))
+
+def iter_files(root: str = DATA_PATH, extensions: tuple = DATA_EXTENSIONS) -> Iterator[str]:
+    """root是文件就只产出它本身，是目录就按文件名顺序递归产出其中的文档"""
+    if os.path.isfile(root):
+        yield root
+        return
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.endswith(extensions):
+                yield os.path.join(dirpath, name)
+
+def iter_paragraphs(path: str) -> Iterator[tuple[int, int, str]]:
+    """逐行读取文件，按空行切段落，产出(起始偏移, 结束偏移, 段落文本)，不会一次性读入整个文件"""
+    offset = 0
+    start = None
+    lines = []
+    with open(path, 'r', encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                if start is None:
+                    start = offset
+                lines.append(line)
+            elif lines:
+                text = "".join(lines).rstrip("\n")
+                yield start, start + len(text), text
+                start, lines = None, []
+            offset += len(line)
+    if lines:
+        text = "".join(lines).rstrip("\n")
+        yield start, start + len(text), text
+
+def split_long(start: int, text: str, max_tokens: int, overlap_tokens: int) -> Iterator[tuple[int, int, str, int]]:
+    """把超过预算的段落按token滑动窗口切开"""
+    spans = [m.span() for m in TOKEN_PATTERN.finditer(text)]
+    step = max(max_tokens - overlap_tokens, 1)
+    for i in range(0, len(spans), step):
+        window = spans[i:i + max_tokens]
+        s, e = window[0][0], window[-1][1]
+        yield start + s, start + e, text[s:e], len(window)
+        if i + max_tokens >= len(spans):
+            break
+
+def is_boundary(text: str, tokens: int, target_tokens: int = TARGET_TOKENS) -> bool:
+    """段落之后是否切分只由段落自身的内容决定：按内容hash以约 tokens/target_tokens 的概率切分。
+    插入或修改一段只会改变它附近的chunk，之后的切分点不变，chunk id也就不变"""
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") < tokens / target_tokens * 2 ** 64
+
+def iter_file_chunks(path: str, max_tokens: int = MAX_TOKENS, overlap_tokens: int = OVERLAP_TOKENS,
+                     target_tokens: int = TARGET_TOKENS) -> Iterator[Chunk]:
+    """把一个文件的段落合并成不超过max_tokens的chunk，切分点由段落内容决定（见is_boundary），
+    超出预算时强制切分；相邻chunk保留约overlap_tokens的重叠段落"""
+    buffer = []  # [(start, end, text, tokens)]
+    buffer_tokens = 0
+    index = 0
+
+    def pieces():
+        for start, end, text in iter_paragraphs(path):
+            tokens = count_tokens(text)
+            if tokens > max_tokens:
+                yield from split_long(start, text, max_tokens, overlap_tokens)
+            else:
+                yield start, end, text, tokens
+
+    def emit():
+        return Chunk(
+            text="\n\n".join(p[2] for p in buffer),
+            source=path,
+            start=buffer[0][0],
+            end=buffer[-1][1],
+            index=index,
+        )
+
+    cut = False  # 上一个段落是否是内容切分点
+    for piece in pieces():
+        if buffer and (cut or buffer_tokens + piece[3] > max_tokens):
+            yield emit()
+            index += 1
+            # 保留尾部不超过overlap_tokens的段落作为下一个chunk的开头
+            tail, tail_tokens = [], 0
+            for p in reversed(buffer):
+                if tail_tokens + p[3] > overlap_tokens or p[1] > piece[0]:
+                    break
+                tail.insert(0, p)
+                tail_tokens += p[3]
+            if tail_tokens + piece[3] > max_tokens:
+                tail, tail_tokens = [], 0
+            buffer, buffer_tokens = tail, tail_tokens
+        buffer.append(piece)
+        buffer_tokens += piece[3]
+        cut = is_boundary(piece[2], piece[3], target_tokens)
+    if buffer:
+        yield emit()
+
+def stream_chunks(root: str = DATA_PATH, max_tokens: int = MAX_TOKENS, overlap_tokens: int = OVERLAP_TOKENS,
+                  target_tokens: int = TARGET_TOKENS) -> Iterator[Chunk]:
+    """逐文件流式产出chunk，整个语料不会同时驻留内存"""
+    for path in iter_files(root):
+        yield from iter_file_chunks(path, max_tokens, overlap_tokens, target_tokens)
 
 if __name__ == "__main__":
-    chunks = get_chunks()
-    for i, chunk in enumerate(chunks):
-        print(f"Chunk {i + 1}:\n{chunk}")
-        print("---" * 10)
\ No newline at end of file
+    for i, chunk in enumerate(stream_chunks()):
+        print(f"Chunk {i + 1} [{chunk.source} {chunk.start}:{chunk.end}, {count_tokens(chunk.text)} tokens]:\n{chunk.text}")
+        print("---" * 10)
@@ -1,13 +1,18 @@
 from pydantic import BaseModel, Field
 from pydantic_ai import Agent, RunContext
-from pydantic_ai.models.openai import OpenAIModel
-from pydantic_ai.providers.openai import OpenAIProvider
 import os
 from dotenv import load_dotenv
+import llm_provider
+import metrics
 import subprocess
-from typing import List
+from typing import List, Literal
+from collections.abc import AsyncIterator
 import webbrowser
 import platform
+import asyncio
+import functools
+import shutil
+import tempfile
 
 load_dotenv()
 
@@ -32,13 +37,34 @@ class ExecutionResult(BaseModel):
     success: bool = Field(description="操作是否成功")
     message: str = Field(description="操作结果描述")
 
+# 执行事件 ——— iter_user_request 按发生顺序逐个产出，调用方（如AG-UI接口）可以边执行边转发
+class PlanEvent(BaseModel):
+    type: Literal["plan"] = "plan"
+    user_input: str = Field(description="用户请求")
+    plan: CommandList = Field(description="完整的指令列表；流式编排时在commander生成完毕后发出，此前可能已有步骤开始执行")
+
+class StepStartedEvent(BaseModel):
+    type: Literal["step_started"] = "step_started"
+    step: int = Field(description="步骤编号，从1开始，与指令列表中的顺序一致")
+    command: Command = Field(description="开始执行的指令")
+
+class StepFinishedEvent(BaseModel):
+    type: Literal["step_finished"] = "step_finished"
+    step: int = Field(description="步骤编号，从1开始，与指令列表中的顺序一致")
+    command: Command = Field(description="执行完毕的指令")
+    result: ExecutionResult = Field(description="执行结果")
+
+class SummaryEvent(BaseModel):
+    type: Literal["summary"] = "summary"
+    total: int = Field(description="总指令数")
+    succeeded: int = Field(description="成功执行的指令数")
+    report: str = Field(description="完整的执行报告（markdown）")
+
+CommandEvent = PlanEvent | StepStartedEvent | StepFinishedEvent | SummaryEvent
+
 # ================== 模型配置 ==================
-deepseek_provider = OpenAIProvider(api_key=os.getenv("DEEPSEEK_API_KEY"),
-                                   base_url="https://api.deepseek.com/v1")
-deepseek_model = OpenAIModel(
-    model_name="deepseek-chat",
-    provider=deepseek_provider
-)
+# 同样的请求得到同样的指令列表，commander 走响应缓存
+deepseek_model = llm_provider.deepseek_model(cache=True)
 
 # ================== 执行器方法 ==================
 def make_file(command: Command) -> ExecutionResult:
@@ -156,10 +182,38 @@ COMMAND_EXECUTORS = {
     7: open_app, # 打开App
 }
 
+# ================== 异步执行器 ==================
+# 文件读写、打开网站/启动进程都是阻塞调用，放到线程里执行，AG-UI服务下一次大文件写入不再卡住其他连接；
+# 同步版本和 COMMAND_EXECUTORS 保持不变，只在同步注册表里登记的执行器也会自动放到线程里执行
+def to_async(executor):
+    """把同步执行器包装成在线程里运行的异步执行器"""
+    @functools.wraps(executor)
+    async def run(command: Command) -> ExecutionResult:
+        return await asyncio.to_thread(executor, command)
+    return run
+
+make_file_async = to_async(make_file)
+remove_file_async = to_async(remove_file)
+read_file_async = to_async(read_file)
+rename_file_async = to_async(rename_file)
+append_file_async = to_async(append_file)
+open_website_async = to_async(open_website)
+open_app_async = to_async(open_app)
+
+ASYNC_COMMAND_EXECUTORS = {
+    1: make_file_async,
+    2: remove_file_async,
+    3: read_file_async,
+    4: rename_file_async,
+    5: append_file_async,
+    6: open_website_async,
+    7: open_app_async,
+}
+
 # ================== Agent 定义 ==================
 # Commander Agent - 负责指令编排
 commander = Agent(
-    model=deepseek_model,
+    model=metrics.MeteredModel(deepseek_model, "commander"),
     system_prompt="""你是一个指令编排器，负责将用户的复杂请求分解为具体的操作指令。
 
 支持的指令类型编号：
@@ -194,83 +248,515 @@ commander = Agent(
 )
 
 # ================== 主要处理函数 ==================
-async def process_user_request(user_input: str) -> str:
-    """处理用户请求的主函数"""
+COMMAND_TYPE_NAMES = {
+    1: "创建文件", 2: "删除文件", 3: "读取文件",
+    4: "重命名文件", 5: "续写文件", 6: "打开网站", 7: "打开App"
+}
+
+def command_name(command: Command) -> str:
+    return COMMAND_TYPE_NAMES.get(command.command_type, f"未知指令({command.command_type})")
+
+def execute_command(command: Command) -> ExecutionResult:
+    executor = COMMAND_EXECUTORS.get(command.command_type)
+    if not executor:
+        return ExecutionResult(success=False, message=f"未知的指令类型: {command.command_type}")
+    return executor(command)
+
+async def execute_command_async(command: Command) -> ExecutionResult:
+    """优先用异步注册表；只登记了同步执行器的指令类型放到线程里执行"""
+    executor = ASYNC_COMMAND_EXECUTORS.get(command.command_type)
+    if executor is None:
+        return await asyncio.to_thread(execute_command, command)
+    return await executor(command)
+
+async def plan_commands(user_input: str) -> CommandList:
+    """第一步：Commander 生成指令列表"""
     print(f"用户输入: {user_input}")
     print("=" * 60)
-    
-    # 第一步：Commander 生成指令列表
     print("Commander 正在分析并生成指令列表...")
     commander_response = await commander.run(user_input)
-    command_list = commander_response.output.commands
-    
-    print(f"Commander 生成了 {len(command_list)} 条指令:")
-    print("说明：", commander_response.output.comments)
-    
-    # 构建执行报告
+    plan = commander_response.output
+    print(f"Commander 生成了 {len(plan.commands)} 条指令:")
+    print("说明：", plan.comments)
+    for i, cmd in enumerate(plan.commands, 1):
+        print(f"  {i}. {command_name(cmd)} -> {cmd.file_info.filename or cmd.file_info.url}")
+    print("-" * 40)
+    return plan
+
+def log_result(result: ExecutionResult):
+    print(f"  结果: {result.message}")
+    print(f"  成功: {result.success}")
+    print("-" * 40)
+
+def log_step(i: int, command: Command, result: ExecutionResult):
+    print(f"执行第 {i} 条指令: {command_name(command)}")
+    log_result(result)
+
+# ================== 并行调度 ==================
+# 按指令之间的依赖关系建DAG：操作同一路径（filename / new_filename）的指令、打开同一个网址/App的指令
+# 保持原来的先后顺序；互不相关的指令（包括打开不同的网站）并发执行，同时执行的指令数有上限
+COMMAND_MAX_WORKERS = int(os.getenv("COMMAND_MAX_WORKERS", 4))
+
+def resource_keys(command: Command) -> set[str]:
+    """指令会读写的资源，两条指令的资源有交集就必须按原顺序执行"""
+    info = command.file_info
+    if command.command_type == 6 and not info.url.startswith("file://"):
+        return {"url:" + info.url.strip()}
+    if command.command_type in (6, 7):
+        if not info.url:
+            return {"app:"}  # 没有指定路径的App（macOS/Linux下固定打开同一个）
+        # 打开刚生成的本地文件/App，要排在写这个路径的指令之后
+        return {os.path.normcase(os.path.abspath(info.url.removeprefix("file://")))}
+    keys = {os.path.normcase(os.path.abspath(info.filename)) if info.filename else ""}
+    if command.command_type == 4 and info.new_filename:
+        keys.add(os.path.normcase(os.path.abspath(info.new_filename)))
+    return keys
+
+# ================== 指令合并（窥孔优化） ==================
+# commander 经常生成 创建→续写→续写→重命名、创建→删除 这样的序列，每条都是一次 open/write/close。
+# 执行前把同一文件上连续的 创建/续写 合并成一次写入，写入后又被删除的直接只删除；
+# 用户看到的每一步结果不变，合并执行失败时退回逐条执行，失败信息也与逐条执行时一致
+COMMAND_FUSION = os.getenv("COMMAND_FUSION", "1") == "1"
+
+class FusedOp(BaseModel):
+    steps: List[int] = Field(description="包含的原始指令下标，按原顺序")
+    action: str = Field(default="single", description="single=原样执行 write=一次写入 discard=写入后又被删除，只需保证文件不存在")
+    filename: str = Field(default="", description="合并操作的文件")
+    mode: str = Field(default="w", description="write 的打开方式，第一条是创建为w，是续写为a")
+    content: str = Field(default="", description="write 要写入的全部内容")
+
+def starts_write(command: Command) -> bool:
+    """可以作为合并起点的指令：有文件名的 创建/续写"""
+    return COMMAND_FUSION and command.command_type in (1, 5) and bool(command.file_info.filename)
+
+def extends_write(keys: set[str], command: Command) -> bool:
+    """command 能否并入 keys 这个文件上正在合并的写入：同一文件的续写，或者收尾的删除"""
+    return resource_keys(command) == keys and command.command_type in (2, 5)
+
+def fused_op(commands: list[Command], steps: list[int]) -> FusedOp:
+    """把同一文件上的 创建/续写 [续写...] [删除] 合并成一个执行单元，只有一条时原样执行"""
+    if len(steps) == 1:
+        return FusedOp(steps=steps)
+    first = commands[steps[0]]
+    return FusedOp(
+        steps=steps,
+        action="discard" if commands[steps[-1]].command_type == 2 else "write",
+        filename=first.file_info.filename,
+        mode='w' if first.command_type == 1 else 'a',
+        content="".join(commands[i].file_info.content for i in steps if commands[i].command_type != 2),
+    )
+
+def optimize_plan(commands: list[Command]) -> list[FusedOp]:
+    """同一文件上从 创建/续写 开始、后面紧跟的续写合并为一次写入，再紧跟删除则整体变为一次删除；
+    中间穿插的其他文件的指令不影响合并，遇到读取、重命名等其他操作同一文件的指令就停止"""
+    ops, consumed = [], set()
+    for i, command in enumerate(commands):
+        if i in consumed:
+            continue
+        if not starts_write(command):
+            ops.append(FusedOp(steps=[i]))
+            continue
+        keys = resource_keys(command)
+        steps = [i]
+        for j in range(i + 1, len(commands)):
+            other = commands[j]
+            if not resource_keys(other) & keys:
+                continue
+            if extends_write(keys, other):
+                steps.append(j)
+                if other.command_type == 5:
+                    continue
+            break
+        consumed.update(steps)
+        ops.append(fused_op(commands, steps))
+    return ops
+
+def fused_result(command: Command) -> ExecutionResult:
+    """合并执行成功时，各原始指令单独执行本应得到的结果"""
+    filename = command.file_info.filename
+    if command.command_type == 1:
+        return ExecutionResult(success=True, message=f"文件 {filename} 创建成功，内容已写入")
+    if command.command_type == 5:
+        return ExecutionResult(success=True, message=f"内容已追加到文件 {filename}")
+    return ExecutionResult(success=True, message=f"文件 {filename} 删除成功")
+
+def execute_fused(op: FusedOp, commands: list[Command]) -> list[ExecutionResult]:
+    """执行合并后的操作，返回其中每条原始指令的结果"""
+    try:
+        if op.action == "write":
+            print(f"正在合并写入文件（{len(op.steps)} 条指令）...")
+            with open(op.filename, op.mode, encoding='utf-8') as f:
+                f.write(op.content)
+        else:
+            print(f"正在合并执行写入后删除（{len(op.steps)} 条指令）...")
+            # 逐条执行时第一步的写入必须能成功，删除才会成功
+            if os.path.isdir(op.filename) or not os.access(os.path.dirname(os.path.abspath(op.filename)), os.W_OK):
+                raise OSError("无法写入")
+            if os.path.exists(op.filename):
+                os.remove(op.filename)
+    except Exception:
+        return [execute_command(commands[i]) for i in op.steps]
+    return [fused_result(commands[i]) for i in op.steps]
+
+class StepScheduler:
+    """按依赖关系调度执行单元：每个单元只等待同一资源上最近一次操作它的单元，互不相关的单元并发执行。
+    单元可以一次性全部提交（execute_plan），也可以边收到指令边提交（流式编排，submit 时只合并紧挨着的同一文件写入）；
+    on_event: 可选的 (StepStartedEvent | StepFinishedEvent) 回调，每条指令开始和结束时各调用一次"""
+    def __init__(self, commands: list[Command] | None = None, first_step: int = 1,
+                 max_workers: int = COMMAND_MAX_WORKERS, on_event=None):
+        self.commands = commands if commands is not None else []
+        self.first_step = first_step
+        self.on_event = on_event
+        self.semaphore = asyncio.Semaphore(max(1, max_workers))
+        self.results: list[ExecutionResult | None] = [None] * len(self.commands)
+        self.tasks: list[asyncio.Task] = []
+        self.last_user: dict[str, asyncio.Task] = {}
+        self.open_write: list[int] | None = None  # 暂存着等待合并的 创建/续写 及紧跟其后的续写下标
+
+    def submit(self, command: Command):
+        """追加一条指令并调度。创建/续写先暂存一条指令的时间：紧跟着的同一文件续写/删除并进来一起执行，
+        下一条指令接不上（或计划结束，见 wait）就立即提交，互不相关的写入不会等到整个计划生成完"""
+        i = len(self.commands)
+        self.commands.append(command)
+        self.results.append(None)
+        if self.open_write is not None:
+            first = self.commands[self.open_write[0]]
+            if extends_write(resource_keys(first), command):
+                self.open_write.append(i)
+                if command.command_type == 2:  # 写入后删除，合并到此为止
+                    self._flush_write()
+                return
+            self._flush_write()
+        if starts_write(command):
+            self.open_write = [i]
+        else:
+            self.submit_op(FusedOp(steps=[i]))
+
+    def _flush_write(self):
+        op = fused_op(self.commands, self.open_write)
+        self.open_write = None
+        if len(op.steps) > 1:
+            print(f"指令合并：第 {', '.join(str(self.first_step + i) for i in op.steps)} 条指令合并为一次执行")
+        self.submit_op(op)
+
+    def submit_op(self, op: FusedOp):
+        keys = set().union(*(resource_keys(self.commands[i]) for i in op.steps))
+        deps = {self.last_user[k] for k in keys if k in self.last_user}
+        task = asyncio.create_task(self._run(op, deps))
+        self.tasks.append(task)
+        for k in keys:
+            self.last_user[k] = task
+
+    async def _run(self, op: FusedOp, deps: set[asyncio.Task]):
+        if deps:
+            await asyncio.gather(*deps)
+        async with self.semaphore:
+            if self.on_event is not None:
+                for i in op.steps:
+                    self.on_event(StepStartedEvent(step=self.first_step + i, command=self.commands[i]))
+            if op.action == "single":
+                step_results = [await execute_command_async(self.commands[op.steps[0]])]
+            else:
+                step_results = await asyncio.to_thread(execute_fused, op, self.commands)
+        for i, result in zip(op.steps, step_results):
+            self.results[i] = result
+            log_step(self.first_step + i, self.commands[i], result)
+            if self.on_event is not None:
+                self.on_event(StepFinishedEvent(step=self.first_step + i, command=self.commands[i], result=result))
+
+    async def wait(self) -> list[ExecutionResult]:
+        """提交暂存的写入，等待全部单元完成，按原始指令顺序返回结果"""
+        if self.open_write is not None:
+            self._flush_write()
+        try:
+            await asyncio.gather(*self.tasks)
+        finally:
+            self.cancel()
+        return self.results
+
+    def cancel(self):
+        for task in self.tasks:
+            task.cancel()
+
+async def execute_plan(commands: list[Command], first_step: int = 1,
+                       max_workers: int = COMMAND_MAX_WORKERS, on_event=None) -> list[ExecutionResult]:
+    """合并冗余的文件操作后按依赖关系并发执行，结果按原始指令顺序返回；某条指令失败不影响后续指令执行，与顺序执行时一致"""
+    ops = optimize_plan(commands)
+    if len(ops) < len(commands):
+        print(f"指令合并：{len(commands)} 条指令合并为 {len(ops)} 次执行")
+    scheduler = StepScheduler(commands, first_step, max_workers, on_event)
+    for op in ops:
+        scheduler.submit_op(op)
+    return await scheduler.wait()
+
+def format_step(step: int, command: Command, result: ExecutionResult) -> str:
+    status_icon = "✅" if result.success else "❌"
+    return f"{status_icon} **步骤 {step}**: {command_name(command)}\n   结果: {result.message}\n"
+
+def format_summary(total: int, succeeded: int) -> str:
+    lines = [
+        "📊 **执行总结**",
+        f"- 总指令数: {total}",
+        f"- 成功执行: {succeeded}",
+        f"- 失败数量: {total - succeeded}",
+        f"- 成功率: {succeeded/total*100:.1f}%" if total else "- 成功率: 0.0%",
+    ]
+    return "\n".join(lines)
+
+def build_report(user_input: str, plan: CommandList, results: list[ExecutionResult]) -> str:
+    """按原始指令顺序生成执行报告"""
+    command_list = plan.commands
     report = []
     report.append(f"📋 **执行计划**")
     report.append(f"用户请求：{user_input}")
     report.append(f"生成指令数：{len(command_list)}")
-    report.append(f"说明：{commander_response.output.comments}")
+    report.append(f"说明：{plan.comments}")
     report.append("")
-    
-    # 显示指令列表
-    command_type_names = {
-        1: "创建文件", 2: "删除文件", 3: "读取文件", 
-        4: "重命名文件", 5: "续写文件", 6: "打开网站", 7: "打开App"
-    }
-    
+
     for i, cmd in enumerate(command_list, 1):
-        cmd_name = command_type_names.get(cmd.command_type, f"未知指令({cmd.command_type})")
-        print(f"  {i}. {cmd_name} -> {cmd.file_info.filename or cmd.file_info.url}")
-        report.append(f"**指令 {i}**: {cmd_name} -> `{cmd.file_info.filename or cmd.file_info.url}`")
+        report.append(f"**指令 {i}**: {command_name(cmd)} -> `{cmd.file_info.filename or cmd.file_info.url}`")
 
-    print("-" * 40)
     report.append("")
     report.append("📄 **执行结果**")
-    
-    # 第二步：程序自动执行指令
+
     success_count = 0
-    for i, command in enumerate(command_list, 1):
-        cmd_name = command_type_names.get(command.command_type, f"未知指令({command.command_type})")
-        print(f"执行第 {i} 条指令: {cmd_name}")
-        
-        # 获取执行器函数
-        executor = COMMAND_EXECUTORS.get(command.command_type)
-        if not executor:
-            result = ExecutionResult(success=False, message=f"未知的指令类型: {command.command_type}")
-        else:
-            result = executor(command)
-        
-        # 记录结果
-        status_icon = "✅" if result.success else "❌"
-        print(f"  结果: {result.message}")
-        print(f"  成功: {result.success}")
-        print("-" * 40)
-        
-        report.append(f"{status_icon} **步骤 {i}**: {cmd_name}")
-        report.append(f"   结果: {result.message}")
-        report.append("")
-        
+    for i, (command, result) in enumerate(zip(command_list, results), 1):
+        report.append(format_step(i, command, result))
         if result.success:
             success_count += 1
-    
+
     # 生成总结
-    total_commands = len(command_list)
-    report.append("📊 **执行总结**")
-    report.append(f"- 总指令数: {total_commands}")
-    report.append(f"- 成功执行: {success_count}")
-    report.append(f"- 失败数量: {total_commands - success_count}")
-    report.append(f"- 成功率: {success_count/total_commands*100:.1f}%")
-    
+    report.append(format_summary(len(command_list), success_count))
+
     final_report = "\n".join(report)
     print("\n" + "="*60)
     print("最终执行报告:")
     print(final_report)
-    
     return final_report
 
+# ================== 流式编排 ==================
+# commander 的指令列表边生成边解析：后一条指令开始出现，前一条就已经完整，立即交给调度器执行，
+# 执行和生成重叠；创建/续写会暂存到下一条指令解析出来，以便和紧跟着的同一文件续写/删除合并
+COMMAND_STREAM_PLAN = os.getenv("COMMAND_STREAM_PLAN", "1") == "1"
+
+async def stream_commands(user_input: str, on_command) -> CommandList:
+    """流式运行 commander，每解析出一条完整指令就调用一次 on_command(command)，返回完整的指令列表"""
+    print(f"用户输入: {user_input}")
+    print("=" * 60)
+    print("Commander 正在流式生成指令列表...")
+    dispatched = 0
+    async with commander.run_stream(user_input) as result:
+        async for partial in result.stream(debounce_by=0.05):
+            while dispatched < len(partial.commands) - 1:
+                cmd = partial.commands[dispatched]
+                dispatched += 1
+                print(f"  {dispatched}. {command_name(cmd)} -> {cmd.file_info.filename or cmd.file_info.url}")
+                on_command(cmd)
+        plan = await result.get_output()
+    for cmd in plan.commands[dispatched:]:
+        dispatched += 1
+        print(f"  {dispatched}. {command_name(cmd)} -> {cmd.file_info.filename or cmd.file_info.url}")
+        on_command(cmd)
+    print(f"Commander 生成了 {len(plan.commands)} 条指令")
+    print("说明：", plan.comments)
+    print("-" * 40)
+    return plan
+
+async def run_user_request(user_input: str, on_event):
+    """规划并执行，过程中的 PlanEvent / StepStartedEvent / StepFinishedEvent 交给 on_event"""
+    if not COMMAND_STREAM_PLAN:
+        plan = await plan_commands(user_input)
+        on_event(PlanEvent(user_input=user_input, plan=plan))
+        # 第二步：程序按依赖关系自动执行指令
+        await execute_plan(plan.commands, on_event=on_event)
+        return
+
+    scheduler = StepScheduler(on_event=on_event)
+    try:
+        plan = await stream_commands(user_input, scheduler.submit)
+    except BaseException:
+        scheduler.cancel()
+        raise
+    on_event(PlanEvent(user_input=user_input, plan=plan))
+    await scheduler.wait()
+
+# ================== 执行事件流 ==================
+# 每条指令一执行完就产出对应事件，调用方不用等整个计划跑完就能展示第一步的结果；
+# 执行报告也由这条事件流里的计划和各步结果拼出来，作为最后一个事件
+async def iter_user_request(user_input: str) -> AsyncIterator[CommandEvent]:
+    """处理用户请求，按发生顺序产出执行事件，最后一个事件是 SummaryEvent；
+    调用方中途停止迭代（如客户端断开）时，还在执行的指令会被取消"""
+    queue: asyncio.Queue[CommandEvent | None] = asyncio.Queue()
+    runner = asyncio.create_task(run_user_request(user_input, queue.put_nowait))
+    runner.add_done_callback(lambda _: queue.put_nowait(None))  # 事件都是同步放入的，结束标记一定排在最后
+    plan = None
+    results: dict[int, ExecutionResult] = {}
+    try:
+        while (event := await queue.get()) is not None:
+            if isinstance(event, PlanEvent):
+                plan = event.plan
+            elif isinstance(event, StepFinishedEvent):
+                results[event.step] = event.result
+            yield event
+        runner.result()  # 规划或执行出错时在这里抛出
+    finally:
+        runner.cancel()
+
+    ordered = [results[i] for i in range(1, len(plan.commands) + 1)]
+    report = build_report(user_input, plan, ordered)
+    yield SummaryEvent(total=len(ordered), succeeded=sum(r.success for r in ordered), report=report)
+
+async def process_user_request(user_input: str) -> str:
+    """处理用户请求的主函数，返回执行报告"""
+    report = ""
+    async for event in iter_user_request(user_input):
+        if isinstance(event, SummaryEvent):
+            report = event.report
+    return report
+
+# ================== 创作内容直接落盘 ==================
+HANDOFF_NOTE = """
+注意：需要写入文件的创作内容正在由writer另外生成，会自动写入你安排的第一条「创建文件」或「续写文件」指令对应的文件。
+请只决定文件名和需要的操作，这条指令的content字段留空，不要自己创作或复制内容。"""
+
+# mkstemp 建出的临时文件是0600，替换目标文件前要改成正常创建文件时的权限
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+def match_file_mode(tmp_path: str, target: str):
+    """目标已存在时沿用它的权限和属主，否则用 open() 新建文件时的默认权限（0666 去掉umask）"""
+    if not os.path.exists(target):
+        os.chmod(tmp_path, 0o666 & ~_UMASK)
+        return
+    shutil.copymode(target, tmp_path)
+    if hasattr(os, "chown"):
+        st = os.stat(target)
+        try:
+            os.chown(tmp_path, st.st_uid, st.st_gid)
+        except OSError:  # 没有权限改属主时保持当前用户
+            pass
+
+class ContentSink:
+    """创作+保存：commander 只决定文件名和操作（与writer并行规划），writer 的内容边生成边追加写进目标文件，
+    不再把全文贴进 commander 的提示词再让它原样抄一遍。
+    创建文件时先写进同目录的临时文件，close() 时再替换成目标文件；续写时记下原来的长度。
+    writer 出错或客户端断开（abort）时删掉临时文件、截回原长度，目标文件保持原样"""
+    def __init__(self, user_input: str):
+        self.user_input = user_input
+        self.plan_task = asyncio.create_task(plan_commands(user_input + HANDOFF_NOTE))
+        self.plan: CommandList | None = None
+        self.sink_index = None  # 负责写入内容的那条指令
+        self.file = None
+        self.tmp_path = None  # 创建文件时实际写入的临时文件
+        self.append_offset = None  # 续写前目标文件的长度
+        self.pending = []  # 计划出来之前收到的内容
+        self.written = ""
+        self.results: dict[int, ExecutionResult] = {}
+
+    async def _start(self, plan: CommandList):
+        """计划就绪：先执行写入指令之前的指令，再打开目标文件并写入已缓存的内容"""
+        self.plan = plan
+        self.sink_index = next((i for i, cmd in enumerate(plan.commands) if cmd.command_type in (1, 5)), None)
+        if self.sink_index is None:  # 没有写入指令：这里不执行任何指令，close() 时整体重新编排，避免同一指令执行两次
+            return
+        for i, result in enumerate(await execute_plan(plan.commands[:self.sink_index])):
+            self.results[i] = result
+        cmd = plan.commands[self.sink_index]
+        try:
+            await asyncio.to_thread(self._open, cmd)
+        except Exception as e:
+            verb = "文件创建失败" if cmd.command_type == 1 else "文件续写失败"
+            self.results[self.sink_index] = ExecutionResult(success=False, message=f"{verb}：{str(e)}")
+        pending, self.pending = "".join(self.pending), []
+        await self._write(pending)
+
+    def _open(self, cmd: Command):
+        filename = cmd.file_info.filename
+        if cmd.command_type == 1:
+            fd, self.tmp_path = tempfile.mkstemp(
+                prefix=os.path.basename(filename) + ".", suffix=".tmp",
+                dir=os.path.dirname(os.path.abspath(filename)))
+            self.file = os.fdopen(fd, 'w', encoding='utf-8')
+            match_file_mode(self.tmp_path, filename)
+        else:
+            self.file = open(filename, 'a', encoding='utf-8')
+            self.append_offset = self.file.tell()
+
+    def _write_sync(self, text: str, rewrite: bool = False):
+        if rewrite:
+            self.file.seek(0)
+            self.file.truncate()
+        self.file.write(text)
+        self.file.flush()
+
+    async def _write(self, text: str, rewrite: bool = False):
+        """文件写入放到线程里，不阻塞事件循环"""
+        if self.file is not None and (text or rewrite):
+            await asyncio.to_thread(self._write_sync, text, rewrite)
+        self.written = text if rewrite else self.written + text
+
+    async def write(self, delta: str):
+        """writer 每生成一段就调用一次；计划还没出来时先缓存"""
+        if self.plan is None and self.plan_task.done():
+            await self._start(self.plan_task.result())
+        if self.plan is None:
+            self.pending.append(delta)
+        else:
+            await self._write(delta)
+
+    def abort(self):
+        """writer 出错或请求被取消时调用：放弃还没完成的规划，撤销对目标文件的改动"""
+        self.plan_task.cancel()
+        if self.file is None:
+            return
+        try:
+            if self.append_offset is not None:
+                self.file.truncate(self.append_offset)
+            self.file.close()
+            if self.tmp_path is not None:
+                os.remove(self.tmp_path)
+        except OSError as e:
+            print(f"撤销未完成的写入失败：{e}")
+        self.file = None
+
+    async def close(self, content: str) -> str:
+        """writer 生成完毕：补齐内容、关闭文件、执行剩余指令并返回执行报告"""
+        if self.plan is None:
+            await self._start(await self.plan_task)
+        plan = self.plan
+        if self.sink_index is None:
+            # commander 没有安排写入指令，退回到把内容贴进提示词的老办法
+            print("Commander 没有安排写入指令，改为完整指令编排")
+            return await process_user_request(self.user_input + "\n下面是由writer创作的内容：\n" + content)
+
+        cmd = plan.commands[self.sink_index]
+        cmd.file_info.content = content
+        print(f"执行第 {self.sink_index + 1} 条指令: {command_name(cmd)}（内容已随创作流式写入）")
+        if self.file is not None:
+            if content.startswith(self.written):
+                await self._write(content[len(self.written):])
+            elif cmd.command_type == 1:
+                # 流式片段和最终结果不一致（极少见），创建文件时整体重写
+                await self._write(content, rewrite=True)
+            file, self.file = self.file, None
+            await asyncio.to_thread(file.close)
+            if cmd.command_type == 1:
+                try:
+                    await asyncio.to_thread(os.replace, self.tmp_path, cmd.file_info.filename)
+                    result = ExecutionResult(success=True, message=f"文件 {cmd.file_info.filename} 创建成功，内容已写入")
+                except Exception as e:
+                    await asyncio.to_thread(os.remove, self.tmp_path)
+                    result = ExecutionResult(success=False, message=f"文件创建失败：{str(e)}")
+            else:
+                result = ExecutionResult(success=True, message=f"内容已追加到文件 {cmd.file_info.filename}")
+            self.results[self.sink_index] = result
+        log_result(self.results[self.sink_index])
+
+        rest = await execute_plan(plan.commands[self.sink_index + 1:], first_step=self.sink_index + 2)
+        for i, result in enumerate(rest, self.sink_index + 1):
+            self.results[i] = result
+        return build_report(self.user_input, plan, [self.results[i] for i in range(len(plan.commands))])
+
 # ================== 测试用例 ==================
 if __name__ == "__main__":
     import asyncio
@@ -289,5 +775,77 @@ if __name__ == "__main__":
             result = await process_user_request(test_input)
             print(f"\n返回结果:\n{result}")
             print("\n" + "="*60)
-    
+
+    # ---------- 指令合并对照：python command.py --check-fusion ----------
+    # 同一组指令分别 逐条顺序执行 / execute_plan合并执行 / 流式调度合并执行，
+    # 每一步的结果和最终的文件状态都必须一致；不需要调用LLM
+    def cmd(command_type: int, filename: str = "", content: str = "", new_filename: str = "") -> Command:
+        return Command(command_type=command_type,
+                       file_info=FileInfo(filename=filename, content=content, new_filename=new_filename))
+
+    fusion_cases = [
+        ("创建→续写→续写→重命名→读取", [], [
+            cmd(1, "a.txt", "A"), cmd(5, "a.txt", "+1"), cmd(5, "a.txt", "+2"),
+            cmd(4, "a.txt", new_filename="b.txt"), cmd(3, "b.txt")]),
+        ("创建→续写→删除→读取", [], [
+            cmd(1, "c.txt", "C"), cmd(5, "c.txt", "x"), cmd(2, "c.txt"), cmd(3, "c.txt")]),
+        ("多个文件交错", [], [
+            cmd(1, "d.txt", "D"), cmd(1, "e.txt", "E"), cmd(5, "d.txt", "+d"), cmd(5, "e.txt", "+e"),
+            cmd(3, "d.txt"), cmd(3, "e.txt")]),
+        ("续写已有文件", [], [
+            cmd(1, "f.txt", "F"), cmd(3, "f.txt"), cmd(5, "f.txt", "1"), cmd(5, "f.txt", "2"), cmd(3, "f.txt")]),
+        ("合并写入失败，退回逐条执行", [], [
+            cmd(1, "missing/g.txt", "G"), cmd(5, "missing/g.txt", "+g")]),
+        ("写入后删除失败，退回逐条执行", ["sub"], [
+            cmd(1, "sub", "X"), cmd(2, "sub")]),
+    ]
+
+    def snapshot(root: str) -> dict[str, str]:
+        files = {}
+        for dirpath, dirnames, filenames in os.walk(root):
+            for name in dirnames:
+                files[os.path.relpath(os.path.join(dirpath, name), root)] = "<dir>"
+            for name in filenames:
+                with open(os.path.join(dirpath, name), 'r', encoding='utf-8') as f:
+                    files[os.path.relpath(os.path.join(dirpath, name), root)] = f.read()
+        return files
+
+    async def run_fusion_case(dirs: list[str], commands: list[Command], mode: str):
+        root = tempfile.mkdtemp(prefix="fusion_check_")
+        cwd = os.getcwd()
+        os.chdir(root)
+        try:
+            for d in dirs:
+                os.makedirs(d)
+            commands = [c.model_copy(deep=True) for c in commands]
+            if mode == "逐条执行":
+                results = [execute_command(c) for c in commands]
+            elif mode == "合并执行":
+                results = await execute_plan(commands)
+            else:
+                scheduler = StepScheduler()
+                for c in commands:
+                    scheduler.submit(c)
+                results = await scheduler.wait()
+            return [r.model_dump() for r in results], snapshot(root)
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(root, ignore_errors=True)
+
+    async def check_fusion() -> bool:
+        global COMMAND_FUSION
+        COMMAND_FUSION = True
+        failed = []
+        for name, dirs, commands in fusion_cases:
+            expected = await run_fusion_case(dirs, commands, "逐条执行")
+            for mode in ("合并执行", "流式合并"):
+                if await run_fusion_case(dirs, commands, mode) != expected:
+                    failed.append(f"{name}（{mode}）")
+        print("\n" + "=" * 60)
+        print(f"指令合并对照：{len(fusion_cases)} 组，{'全部一致' if not failed else '不一致：' + '、'.join(failed)}")
+        return not failed
+
+    import sys
+    if "--check-fusion" in sys.argv:
+        sys.exit(0 if asyncio.run(check_fusion()) else 1)
     asyncio.run(run_tests())
\ No newline at end of file
@@ -0,0 +1,81 @@
+from pydantic import BaseModel, Field
+from bm25 import tokenize
+from chunking import TOKEN_PATTERN, count_tokens
+
+CONTEXT_TOKEN_BUDGET = 1500  # 检索结果拼进提示词的token上限
+MMR_LAMBDA = 0.7             # 相关性与多样性的权衡，越大越看重相关性
+DEDUP_THRESHOLD = 0.8        # 与已选chunk的相似度超过该值视为近似重复，直接丢弃
+SEPARATOR = "\n------\n"
+
+class PackedContext(BaseModel):
+    text: str = Field(description="打包后的上下文")
+    kept: int = Field(description="保留的chunk数")
+    dropped: int = Field(description="因重复或超出预算丢弃的chunk数")
+    original_tokens: int = Field(description="直接拼接全部chunk的token数")
+    used_tokens: int = Field(description="打包后的token数")
+
+    @property
+    def saved_tokens(self) -> int:
+        return self.original_tokens - self.used_tokens
+
+def similarity(a: set[str], b: set[str]) -> float:
+    """词项集合的Jaccard相似度，不需要额外的embedding请求"""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    if max_tokens <= 0:
+        return ""
+    for i, m in enumerate(TOKEN_PATTERN.finditer(text), 1):
+        if i == max_tokens:
+            return text[:m.end()]
+    return text
+
+def mmr_order(docs: list[str], lambda_: float = MMR_LAMBDA, dedup_threshold: float = DEDUP_THRESHOLD) -> list[int]:
+    """最大边际相关性重排：docs按检索排名给出，排名越靠前相关性越高；近似重复的chunk被剔除"""
+    terms = [set(tokenize(d)) for d in docs]
+    relevance = [1 - i / len(docs) for i in range(len(docs))]
+    remaining = list(range(len(docs)))
+    selected = []
+    while remaining:
+        best, best_score = None, None
+        for i in remaining[:]:
+            redundancy = max((similarity(terms[i], terms[j]) for j in selected), default=0.0)
+            if redundancy >= dedup_threshold:
+                remaining.remove(i)
+                continue
+            score = lambda_ * relevance[i] - (1 - lambda_) * redundancy
+            if best_score is None or score > best_score:
+                best, best_score = i, score
+        if best is None:
+            break
+        selected.append(best)
+        remaining.remove(best)
+    return selected
+
+def pack_context(docs: list[str], token_budget: int = CONTEXT_TOKEN_BUDGET, lambda_: float = MMR_LAMBDA,
+                 dedup_threshold: float = DEDUP_THRESHOLD, separator: str = SEPARATOR) -> PackedContext:
+    """MMR去重后按顺序装入token预算，最后一个装不下的chunk截断填满剩余预算"""
+    original_tokens = count_tokens(separator.join(docs))
+    sep_tokens = count_tokens(separator)
+    parts, used = [], 0
+    for i in mmr_order(docs, lambda_, dedup_threshold):
+        cost = count_tokens(docs[i]) + (sep_tokens if parts else 0)
+        if used + cost <= token_budget:
+            parts.append(docs[i])
+            used += cost
+            continue
+        remaining = token_budget - used - (sep_tokens if parts else 0)
+        if remaining > 0:
+            parts.append(truncate_tokens(docs[i], remaining))
+            used += remaining + (sep_tokens if len(parts) > 1 else 0)
+        break
+    text = separator.join(parts)
+    return PackedContext(
+        text=text,
+        kept=len(parts),
+        dropped=len(docs) - len(parts),
+        original_tokens=original_tokens,
+        used_tokens=count_tokens(text),
+    )
@@ -0,0 +1,66 @@
+import asyncio
+from collections import OrderedDict
+
+# ================== 会话状态 ==================
+# 按 AG-UI 的 threadId 保存「滚动摘要 + 最近N条消息」，divider 拿到的上下文长度有上限，
+# 不再随对话轮数增长；较早的消息在后台增量合并进摘要
+class ThreadState:
+    def __init__(self):
+        self.summary = ""
+        self.summarized = 0  # 已经合并进摘要的消息条数
+        self.task: asyncio.Task | None = None
+
+class ConversationStore:
+    def __init__(self, summarize, recent_messages: int = 6, max_message_chars: int = 2000, max_threads: int = 1000):
+        """summarize: async (旧摘要, 新消息文本) -> 新摘要"""
+        self.summarize = summarize
+        self.recent_messages = recent_messages
+        self.max_message_chars = max_message_chars
+        self.max_threads = max_threads
+        self.threads: OrderedDict[str, ThreadState] = OrderedDict()
+
+    def _state(self, thread_id: str) -> ThreadState:
+        state = self.threads.get(thread_id)
+        if state is None:
+            state = self.threads[thread_id] = ThreadState()
+            while len(self.threads) > self.max_threads:  # LRU淘汰最久不活跃的会话
+                _, old = self.threads.popitem(last=False)
+                if old.task is not None:
+                    old.task.cancel()
+        self.threads.move_to_end(thread_id)
+        return state
+
+    def format_message(self, message) -> str:
+        content = message.content or ""
+        if len(content) > self.max_message_chars:
+            content = content[:self.max_message_chars] + "...(已截断)"
+        return f"{message.role}: {content}"
+
+    def build_context(self, thread_id: str, messages: list) -> str:
+        """返回给 divider 的历史上下文（不含最新一条消息），必要时在后台更新摘要"""
+        state = self._state(thread_id)
+        history = messages[:-1]
+        if state.summarized > len(history):  # 客户端重置或改写了历史，摘要作废
+            state.summary, state.summarized = "", 0
+        boundary = max(len(history) - self.recent_messages, 0)
+        if boundary > state.summarized and (state.task is None or state.task.done()):
+            state.task = asyncio.create_task(self._update_summary(state, history[state.summarized:boundary], boundary))
+
+        parts = []
+        if state.summary:
+            parts.append("对话摘要：\n" + state.summary)
+        # 摘要还没追上时，尚未合并的较早消息原样带上，不能丢（名字、文件内容常常就在这几条里）
+        recent = history[state.summarized:]
+        if recent:
+            parts.append("最近对话：\n" + "\n".join(self.format_message(m) for m in recent))
+        return "\n---\n".join(parts)
+
+    async def _update_summary(self, state: ThreadState, messages: list, boundary: int):
+        try:
+            text = "\n".join(self.format_message(m) for m in messages)
+            state.summary = await self.summarize(state.summary, text)
+            state.summarized = boundary
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[Conversation] 摘要更新失败：{e}")
@@ -0,0 +1,100 @@
+import asyncio
+import time
+
+# ================== 查询embedding合并 ==================
+# 1. single-flight：同一文本正在请求时，后来的调用直接等待同一个future
+# 2. 微批：window秒内到达的不同文本合并成一次批量embedding请求
+class EmbeddingBatcher:
+    def __init__(self, embed_many, window: float = 0.01, max_batch: int = 100):
+        """embed_many: async (texts, store) -> 向量列表，例如 embeding.get_embeddings_async"""
+        self.embed_many = embed_many
+        self.window = window
+        self.max_batch = max_batch
+        self._loop = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.requests = 0
+        self.coalesced = 0
+        self.batches = 0
+        self.batched_texts = 0
+        self.max_batch_size = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:  # 换了事件循环（比如多次asyncio.run），旧的future不能再用
+            self._loop = loop
+            self._inflight = {}  # (store, text) -> future
+            self._queues = {True: [], False: []}  # store -> [(text, 入队时间)]
+            self._timers = {}
+            self._tasks = set()
+        return loop
+
+    async def embed(self, text: str, store: bool) -> list[float]:
+        loop = self._bind_loop()
+        self.requests += 1
+        key = (store, text)
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            future = loop.create_future()
+            self._inflight[key] = future
+            queue = self._queues[store]
+            queue.append((text, time.perf_counter()))
+            if len(queue) >= self.max_batch:
+                self._flush(store)
+            elif store not in self._timers:
+                self._timers[store] = loop.call_later(self.window, self._flush, store)
+        # shield：某个调用方被取消时不影响其他等待同一结果的调用方
+        return await asyncio.shield(future)
+
+    def _flush(self, store: bool):
+        timer = self._timers.pop(store, None)
+        if timer is not None:
+            timer.cancel()
+        items, self._queues[store] = self._queues[store], []
+        if items:
+            task = self._loop.create_task(self._run(store, items))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, store: bool, items: list[tuple[str, float]]):
+        now = time.perf_counter()
+        texts = [text for text, _ in items]
+        for _, queued_at in items:
+            self.total_wait += now - queued_at
+            self.max_wait = max(self.max_wait, now - queued_at)
+        self.batches += 1
+        self.batched_texts += len(texts)
+        self.max_batch_size = max(self.max_batch_size, len(texts))
+        try:
+            vectors = await self.embed_many(texts, store)
+        except asyncio.CancelledError:
+            for text in texts:
+                self._inflight.pop((store, text)).cancel()
+            raise
+        except Exception as e:
+            for text in texts:
+                future = self._inflight.pop((store, text))
+                if not future.done():
+                    future.set_exception(e)
+                    future.exception()  # 标记已读取，没人等待时不打印警告
+        else:
+            for text, vector in zip(texts, vectors):
+                future = self._inflight.pop((store, text))
+                if not future.done():
+                    future.set_result(vector)
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "coalesced": self.coalesced,
+            "batches": self.batches,
+            "avg_batch_size": self.batched_texts / self.batches if self.batches else 0.0,
+            "max_batch_size": self.max_batch_size,
+            "avg_wait_ms": self.total_wait / self.batched_texts * 1000 if self.batched_texts else 0.0,
+            "max_wait_ms": self.max_wait * 1000,
+        }
@@ -0,0 +1,128 @@
+import atexit
+import sqlite3
+import hashlib
+import threading
+import time
+from array import array
+
+# ================== 向量缓存 ==================
+# 以 (model, task_type, 文本hash) 为key的磁盘缓存，同样的文本不再重复请求embedding接口。
+# 命中时的访问时间先记在内存里，攒够一批、超过间隔、写入新条目（淘汰前）或进程退出时才批量落盘，
+# 重复查询不再每次都付出一次同步的SQLite写事务
+class EmbeddingCache:
+    def __init__(self, path: str = "./embed_cache.db", max_entries: int = 100_000,
+                 access_flush_interval: float = 30.0, access_flush_size: int = 1000):
+        self.max_entries = max_entries
+        self.access_flush_interval = access_flush_interval
+        self.access_flush_size = access_flush_size
+        self._touched: dict[str, float] = {}  # 还没落盘的 key -> 最近访问时间
+        self._last_flush = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON embeddings(last_access)")
+        self._conn.commit()
+        atexit.register(self._flush_at_exit)
+
+    @staticmethod
+    def make_key(model: str, task_type: str, text: str) -> str:
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{model}:{task_type}:{digest}"
+
+    def get_many(self, keys: list[str]) -> dict[str, list[float]]:
+        """批量查询，返回命中的 key -> 向量"""
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):  # sqlite单条语句变量数有限制
+                part = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(part))})",
+                    part,
+                ).fetchall()
+                for key, blob in rows:
+                    vec = array("f")
+                    vec.frombytes(blob)
+                    found[key] = vec.tolist()
+            if found:
+                now = time.time()
+                self._touched.update((k, now) for k in found)
+                if len(self._touched) >= self.access_flush_size or \
+                        time.monotonic() - self._last_flush >= self.access_flush_interval:
+                    self._flush_access()
+                    self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items: dict[str, list[float]]):
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_access) VALUES (?, ?, ?)",
+                [(k, array("f", v).tobytes(), now) for k, v in items.items()],
+            )
+            self._flush_access()  # 淘汰按last_access排序，先把内存里的访问时间写进去
+            self._evict()
+            self._conn.commit()
+
+    def _flush_access(self):
+        """把内存里攒下的访问时间写进数据库（调用方持有锁并负责commit）"""
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                [(t, k) for k, t in self._touched.items()],
+            )
+            self._touched.clear()
+        self._last_flush = time.monotonic()
+
+    def flush(self):
+        with self._lock:
+            self._flush_access()
+            self._conn.commit()
+
+    def _flush_at_exit(self):
+        try:
+            self.flush()
+        except sqlite3.Error as e:  # 数据库文件可能已经被删除（如基准测试的临时目录）
+            print(f"向量缓存访问时间落盘失败：{e}")
+
+    def _evict(self):
+        """超过容量时按最近访问时间淘汰最旧的条目"""
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+                (overflow,),
+            )
+
+    def stats(self) -> dict:
+        with self._lock:
+            (size,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": size,
+            "max_entries": self.max_entries,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self._touched.clear()
+            self.hits = 0
+            self.misses = 0
@@ -0,0 +1,181 @@
+import json
+import math
+import os
+import random
+import re
+import threading
+from collections import Counter, defaultdict
+from pydantic import BaseModel, Field
+
+# ================== 本地意图预分类 ==================
+# 在 divider 之前先用规则 + 字符n-gram朴素贝叶斯判断 ques_type（0=指令 1=自然语言 2=创作+文件），
+# 有把握的直接决定，省掉一次 divider 的LLM往返；没把握的再交给 divider，并把 divider 的结果记下来继续训练。
+# 代码类、需要上下文/联网/mcp补充信息的请求由规则一票否决，一定交给 divider；有对话历史时指令/创作类请求
+# 也交给 divider（只有它会把历史里的内容整理进 information）；
+# 规则和模型的结论都按 (来源, 类型) 先以影子模式和 divider 比对，实测一致率达到阈值之后才允许跳过 divider
+
+FILE_OP = re.compile(r'创建|新建|删除|读取|查看|重命名|改名|续写|追加|写入|写进|写到|保存|记录|存到|存为')
+FILE_TARGET = re.compile(r'[\w\-]+\.(txt|md|json|csv|docx?|html|log)\b|文件', re.IGNORECASE)
+OPEN_WEB = re.compile(r'(打开|访问).{0,10}(网站|网页|https?://|www\.)', re.IGNORECASE)
+OPEN_APP = re.compile(r'打开.{0,8}(网易云|QQ|微信|腾讯会议|app|应用|软件)', re.IGNORECASE)
+CREATIVE = re.compile(r'(写|创作|作|编).{0,8}(诗|词|小说|散文|故事|文章|作文|论文|歌|报告|剧本)')
+CODE = re.compile(r'代码|程序|函数|脚本|python|java|c\+\+|\.py\b|\.js\b', re.IGNORECASE)
+# 需要结合上下文、联网或mcp服务补充信息的请求，只有 divider 能处理好
+NEEDS_CONTEXT = re.compile(r'上面|上述|刚才|刚刚|之前|前面|这个|这段|这首|这篇|这些|那个|那首|那篇|它|结果|回答|我的|学号|姓名|名字|mcp|a2a|上网|搜索|查询', re.IGNORECASE)
+
+class IntentDecision(BaseModel):
+    ques_type: int | None = Field(default=None, description="预测的问题类型，None表示没有结论")
+    confidence: float = Field(default=0.0, description="预测置信度")
+    source: str = Field(default="none", description="rule / model / veto / none")
+    veto: bool = Field(default=False, description="规则判定必须交给 divider，模型不再参与")
+
+class IntentClassifier:
+    def __init__(self, log_path: str = "./intent_log.jsonl", threshold: float = 0.9,
+                 min_samples: int = 50, audit_rate: float = 0.05):
+        """threshold: 置信度达到该值才直接决定，还要求同一 (来源, 类型) 的实测一致率也达到该值；
+        min_samples: 训练样本不足时只用规则，同一 (来源, 类型) 达到阈值的结论与 divider 比对满这么多次之后才可能被采信；
+        audit_rate: 有把握的请求中仍抽样交给 divider 复核的比例，用于统计一致率"""
+        self.log_path = log_path
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.audit_rate = audit_rate
+        self._lock = threading.Lock()
+        self.class_counts = Counter()
+        self.term_counts = defaultdict(Counter)  # ques_type -> n-gram计数
+        self.vocab = set()
+        self.total = 0
+        self.bypassed = 0
+        self.compared = 0
+        self.agreed = 0
+        self.audited = 0  # 有把握但被抽中复核的请求
+        self.audit_agreed = 0
+        # "来源:类型" -> 达到阈值的结论与 divider 比对的次数 / 一致的次数（不持久化，重启后重新校准）
+        self.checked = Counter()
+        self.checked_agreed = Counter()
+        self._load()
+
+    # ---------- 特征与训练 ----------
+    @staticmethod
+    def features(text: str) -> list[str]:
+        text = re.sub(r'\s+', ' ', text.lower())
+        return [text[i:i + 2] for i in range(len(text) - 1)] + [text[i:i + 3] for i in range(len(text) - 2)]
+
+    def _learn(self, text: str, ques_type: int):
+        feats = self.features(text)
+        self.class_counts[ques_type] += 1
+        self.term_counts[ques_type].update(feats)
+        self.vocab.update(feats)
+
+    def _load(self):
+        if not os.path.exists(self.log_path):
+            return
+        with open(self.log_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    item = json.loads(line)
+                    self._learn(item["text"], item["ques_type"])
+                except (ValueError, KeyError):
+                    continue
+
+    # ---------- 预测 ----------
+    def rule(self, text: str) -> IntentDecision:
+        if CODE.search(text) or NEEDS_CONTEXT.search(text):
+            return IntentDecision(source="veto", veto=True)
+        creative = CREATIVE.search(text)
+        file_op = FILE_OP.search(text) and FILE_TARGET.search(text)
+        if creative and file_op:
+            return IntentDecision(ques_type=2, confidence=0.95, source="rule")
+        if creative:
+            return IntentDecision(ques_type=1, confidence=0.95, source="rule")
+        if file_op or OPEN_WEB.search(text) or OPEN_APP.search(text):
+            return IntentDecision(ques_type=0, confidence=0.95, source="rule")
+        if not FILE_OP.search(text) and not FILE_TARGET.search(text) and not re.search(r'打开|网站|网址|https?://', text):
+            return IntentDecision(ques_type=1, confidence=0.9, source="rule")
+        return IntentDecision()
+
+    def model(self, text: str) -> IntentDecision:
+        """n-gram之间高度相关，直接相乘的后验几乎总是接近1；似然按特征数取平均（几何平均）后再归一化，
+        置信度只作排序用，能否采信由 trusted 按实测一致率决定"""
+        samples = sum(self.class_counts.values())
+        feats = self.features(text)
+        if samples < self.min_samples or not feats:
+            return IntentDecision()
+        vocab_size = len(self.vocab) + 1
+        log_probs = {}
+        for ques_type, count in self.class_counts.items():
+            terms = self.term_counts[ques_type]
+            denom = sum(terms.values()) + vocab_size
+            likelihood = sum(math.log((terms[f] + 1) / denom) for f in feats) / len(feats)
+            log_probs[ques_type] = math.log(count / samples) + likelihood
+        best = max(log_probs, key=log_probs.get)
+        norm = sum(math.exp(lp - log_probs[best]) for lp in log_probs.values())
+        return IntentDecision(ques_type=best, confidence=1 / norm, source="model")
+
+    def predict(self, text: str) -> IntentDecision:
+        with self._lock:
+            decision = self.rule(text)
+            if decision.ques_type is None and not decision.veto:
+                decision = self.model(text)
+            return decision
+
+    @staticmethod
+    def calibration_key(decision: IntentDecision) -> str:
+        return f"{decision.source}:{decision.ques_type}"
+
+    def trusted(self, decision: IntentDecision) -> bool:
+        """同一 (来源, 类型) 达到阈值的结论与 divider 比对了足够多次，且一致率不低于阈值"""
+        key = self.calibration_key(decision)
+        return self.checked[key] >= self.min_samples and self.checked_agreed[key] >= self.threshold * self.checked[key]
+
+    def should_bypass(self, decision: IntentDecision, has_history: bool = False) -> bool:
+        """有把握、没有被规则否决、已经校准过且没有被抽中复核时跳过 divider；
+        has_history: 有对话历史时指令/创作类请求可能要用到历史里的内容，不跳过"""
+        with self._lock:
+            self.total += 1
+            if decision.veto or decision.ques_type is None or decision.confidence < self.threshold:
+                return False
+            if has_history and decision.ques_type in (0, 2):
+                return False
+            if not self.trusted(decision):
+                return False
+            if random.random() < self.audit_rate:
+                return False
+            self.bypassed += 1
+            return True
+
+    def record(self, text: str, divider_type: int, decision: IntentDecision):
+        """记录 divider 的决定：累计一致率，并作为新的训练样本"""
+        with self._lock:
+            if decision.ques_type is not None:
+                agreed = decision.ques_type == divider_type
+                self.compared += 1
+                self.agreed += agreed
+                if decision.confidence >= self.threshold:
+                    self.audited += 1
+                    self.audit_agreed += agreed
+                    key = self.calibration_key(decision)
+                    self.checked[key] += 1
+                    self.checked_agreed[key] += agreed
+            self._learn(text, divider_type)
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"text": text, "ques_type": divider_type}, ensure_ascii=False) + "\n")
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.total,
+            "bypassed": self.bypassed,
+            "bypass_rate": self.bypassed / self.total if self.total else 0.0,
+            "compared": self.compared,
+            "agreement_rate": self.agreed / self.compared if self.compared else 0.0,
+            "audited": self.audited,
+            "audit_agreement_rate": self.audit_agreed / self.audited if self.audited else 0.0,
+            "training_samples": sum(self.class_counts.values()),
+            "calibration": {
+                key: {
+                    "checked": n,
+                    "agreement_rate": self.checked_agreed[key] / n,
+                    "trusted": n >= self.min_samples and self.checked_agreed[key] >= self.threshold * n,
+                }
+                for key, n in self.checked.items()
+            },
+        }
@@ -0,0 +1,235 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from dataclasses import asdict, dataclass, field, replace
+from datetime import datetime, timezone
+
+from pydantic_ai.messages import (
+    ModelMessage, ModelMessagesTypeAdapter, ModelResponse, ModelResponseStreamEvent,
+    TextPart, ThinkingPart, ToolCallPart,
+)
+from pydantic_ai.models import ModelRequestParameters, StreamedResponse
+from pydantic_ai.models.wrapper import WrapperModel
+from pydantic_ai.settings import ModelSettings
+from pydantic_ai.usage import Usage
+
+# ================== LLM响应缓存 ==================
+# 以 (模型, 系统提示词, 消息历史, 工具, 输出schema, 模型参数) 为key的磁盘缓存，
+# 同样的请求（比如同一输入的 commander 规划、divider 分类）不再重复调用接口；条目有TTL，超过容量按LRU淘汰
+class ResponseCache:
+    def __init__(self, path: str = "./llm_cache.db", ttl: float = 24 * 3600, max_entries: int = 10_000):
+        """ttl: 条目有效期（秒），<=0 表示永不过期"""
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response BLOB NOT NULL,
+                created REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_response_access ON responses(last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model: str, messages: list[ModelMessage], model_settings: ModelSettings | None,
+                 params: ModelRequestParameters) -> str:
+        """系统提示词包含在 messages 的 SystemPromptPart 中；时间戳、请求id这类每次都不同的字段不参与计算"""
+        def strip(value):
+            if isinstance(value, dict):
+                return {k: strip(v) for k, v in value.items() if k not in VOLATILE_FIELDS}
+            if isinstance(value, list):
+                return [strip(v) for v in value]
+            return value
+        payload = {
+            "model": model,
+            "messages": strip(ModelMessagesTypeAdapter.dump_python(messages, mode="json")),
+            "settings": model_settings or {},
+            "params": asdict(params),
+        }
+        blob = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+        return f"{model}:{hashlib.sha256(blob.encode('utf-8')).hexdigest()}"
+
+    def get(self, key: str) -> ModelResponse | None:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl > 0 and now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return ModelMessagesTypeAdapter.validate_json(row[0])[0]
+
+    def put(self, key: str, response: ModelResponse):
+        blob = ModelMessagesTypeAdapter.dump_json([response])
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created, last_access) VALUES (?, ?, ?, ?)",
+                (key, blob, now, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        """先删过期条目，仍超过容量时按最近访问时间淘汰最旧的条目"""
+        if self.ttl > 0:
+            self._conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses ORDER BY last_access ASC LIMIT ?)",
+                (overflow,),
+            )
+
+    def stats(self) -> dict:
+        with self._lock:
+            (size,) = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": size,
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+            self.hits = 0
+            self.misses = 0
+
+VOLATILE_FIELDS = {"timestamp", "vendor_id", "vendor_details"}
+
+# ================== 流式响应 ==================
+@dataclass
+class ReplayStreamedResponse(StreamedResponse):
+    """把缓存里的完整响应按part重新以流式事件发出，调用方（run_stream / run_ag_ui）感知不到差别"""
+    _model_name: str
+    _response: ModelResponse
+    _timestamp: datetime = field(default_factory=lambda: datetime.now(timezone.utc), init=False)
+
+    async def _get_event_iterator(self) -> AsyncIterator[ModelResponseStreamEvent]:
+        for i, part in enumerate(self._response.parts):
+            if isinstance(part, TextPart):
+                event = self._parts_manager.handle_text_delta(vendor_part_id=i, content=part.content)
+                if event is not None:
+                    yield event
+            elif isinstance(part, ThinkingPart):
+                yield self._parts_manager.handle_thinking_delta(
+                    vendor_part_id=i, content=part.content, signature=part.signature
+                )
+            elif isinstance(part, ToolCallPart):
+                yield self._parts_manager.handle_tool_call_part(
+                    vendor_part_id=i, tool_name=part.tool_name, args=part.args, tool_call_id=part.tool_call_id
+                )
+
+    @property
+    def model_name(self) -> str:
+        return self._model_name
+
+    @property
+    def timestamp(self) -> datetime:
+        return self._timestamp
+
+@dataclass
+class RecordingStreamedResponse(StreamedResponse):
+    """透传底层流，只有完整读完的流才写进缓存（中途取消或出错的不完整响应不缓存）"""
+    _wrapped: StreamedResponse
+    complete: bool = field(default=False, init=False)
+
+    async def _get_event_iterator(self) -> AsyncIterator[ModelResponseStreamEvent]:
+        async for event in self._wrapped:
+            yield event
+        self.complete = True
+
+    def get(self) -> ModelResponse:
+        return self._wrapped.get()
+
+    def usage(self) -> Usage:
+        return self._wrapped.usage()
+
+    @property
+    def model_name(self) -> str:
+        return self._wrapped.model_name
+
+    @property
+    def timestamp(self) -> datetime:
+        return self._wrapped.timestamp
+
+# ================== 缓存模型 ==================
+class CachedModel(WrapperModel):
+    """包在任意 pydantic_ai 模型外面，Agent(model=CachedModel(model, cache)) 即可使用；
+    命中时不产生token消耗，返回的 usage 为空"""
+    def __init__(self, wrapped, cache: ResponseCache):
+        super().__init__(wrapped)
+        self.cache = cache
+
+    def _key(self, messages, model_settings, model_request_parameters) -> str:
+        return self.cache.make_key(f"{self.system}:{self.model_name}", messages, model_settings, model_request_parameters)
+
+    @staticmethod
+    def _replayed(response: ModelResponse) -> ModelResponse:
+        return replace(response, usage=Usage(), timestamp=datetime.now(timezone.utc))
+
+    async def request(self, messages: list[ModelMessage], model_settings: ModelSettings | None,
+                      model_request_parameters: ModelRequestParameters) -> ModelResponse:
+        key = self._key(messages, model_settings, model_request_parameters)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return self._replayed(cached)
+        response = await self.wrapped.request(messages, model_settings, model_request_parameters)
+        self.cache.put(key, response)
+        return response
+
+    @asynccontextmanager
+    async def request_stream(self, messages: list[ModelMessage], model_settings: ModelSettings | None,
+                             model_request_parameters: ModelRequestParameters) -> AsyncIterator[StreamedResponse]:
+        key = self._key(messages, model_settings, model_request_parameters)
+        cached = self.cache.get(key)
+        if cached is not None:
+            yield ReplayStreamedResponse(_model_name=cached.model_name or self.model_name, _response=cached)
+            return
+        async with self.wrapped.request_stream(messages, model_settings, model_request_parameters) as stream:
+            recording = RecordingStreamedResponse(_wrapped=stream)
+            yield recording
+            if recording.complete:
+                self.cache.put(key, recording.get())
+
+# 进程内共享的缓存，LLM_CACHE=0 关闭；第一次有模型要求缓存时才创建数据库文件
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE", "1") == "1"
+response_cache: ResponseCache | None = None
+
+def cached(model):
+    """给模型套上共享缓存；缓存关闭时原样返回"""
+    global response_cache
+    if not LLM_CACHE_ENABLED:
+        return model
+    if response_cache is None:
+        response_cache = ResponseCache(
+            os.getenv("LLM_CACHE_PATH", "./llm_cache.db"),
+            ttl=float(os.getenv("LLM_CACHE_TTL", 24 * 3600)),
+            max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", 10_000)),
+        )
+    return CachedModel(model, response_cache)
@@ -0,0 +1,70 @@
+import importlib.util
+import os
+
+import httpx
+from dotenv import load_dotenv
+from pydantic_ai.models.openai import OpenAIModel
+from pydantic_ai.providers.openai import OpenAIProvider
+
+import llm_cache
+
+load_dotenv()
+
+# ================== 共享连接池与模型工厂 ==================
+# 进程内所有 agent（divider / writer / agent / commander / summarizer ...）共用一个调好参数的 httpx.AsyncClient，
+# 复用 keep-alive 连接，HTTP/2 下多个请求在同一条连接上多路复用，高并发时不再反复做TLS握手和建连
+DEEPSEEK_BASE_URL = "https://api.deepseek.com/v1"
+DEEPSEEK_MODEL = "deepseek-chat"
+
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "1") == "1"
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 100))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", 20))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", 60))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", 10))
+LLM_POOL_TIMEOUT = float(os.getenv("LLM_POOL_TIMEOUT", 30))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", 600))  # 长文本生成可能持续数分钟
+
+_http_client: httpx.AsyncClient | None = None
+_providers: dict[tuple[str, str | None], OpenAIProvider] = {}
+
+def http_client() -> httpx.AsyncClient:
+    """进程内共享的连接池；被关闭后再次调用会重新创建"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        http2 = LLM_HTTP2 and importlib.util.find_spec("h2") is not None
+        if LLM_HTTP2 and not http2:
+            print("[LLM] 未安装h2，退回HTTP/1.1（pip install h2 以启用HTTP/2）")
+        _http_client = httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE,
+                keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT, pool=LLM_POOL_TIMEOUT),
+        )
+        _providers.clear()  # 旧provider还指向已关闭的连接池
+    return _http_client
+
+def provider(base_url: str = DEEPSEEK_BASE_URL, api_key: str | None = None) -> OpenAIProvider:
+    """同一 (base_url, api_key) 只创建一个provider，全部共用 http_client()"""
+    client = http_client()
+    api_key = api_key or os.getenv("DEEPSEEK_API_KEY")
+    key = (base_url, api_key)
+    if key not in _providers:
+        _providers[key] = OpenAIProvider(api_key=api_key, base_url=base_url, http_client=client)
+    return _providers[key]
+
+def deepseek_model(model_name: str = DEEPSEEK_MODEL, cache: bool = False):
+    """构建使用共享连接池的 DeepSeek 模型；cache=True 时套上 llm_cache 的响应缓存，
+    只适合输出应当确定的agent（divider 分类、commander 规划），创作和对话类的agent不要缓存"""
+    model = OpenAIModel(model_name=model_name, provider=provider())
+    return llm_cache.cached(model) if cache else model
+
+async def aclose():
+    """进程退出（如FastAPI lifespan结束）时关闭连接池"""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+        _providers.clear()
@@ -0,0 +1,172 @@
+import asyncio
+from contextlib import AsyncExitStack
+from datetime import timedelta
+
+from mcp import ClientSession, McpError
+from mcp import types as mcp_types
+from pydantic_ai.exceptions import ModelRetry
+from pydantic_ai.mcp import MCPServerStreamableHTTP
+
+# ================== 共享MCP会话 ==================
+# 整个应用只保持一条长连接的MCP会话（在FastAPI lifespan里启动），divider / writer / agent 共用；
+# 工具列表缓存在本地，服务端发来 tools/list_changed 通知或重连后才重新拉取
+MCP_RETRY_INTERVAL = 2.0  # 连接失败或断开后的重连间隔（秒）
+
+class SharedMCPServer(MCPServerStreamableHTTP):
+    """start() 之后，会话由一个后台任务持有（建连和关闭在同一个任务里完成），
+    各次 agent 运行的 async with 只等待连接就绪，不再各自建连和握手；没有 start() 时行为与父类相同"""
+    def __post_init__(self):
+        super().__post_init__()
+        self._keeper: asyncio.Task | None = None
+        self._ready = asyncio.Event()
+        self._broken = asyncio.Event()
+        self._session_closed: asyncio.Event | None = None  # 当前会话结束时置位
+        self._tools: list[mcp_types.Tool] | None = None
+        self._tools_version = 0  # 每次失效加一，防止拉取途中失效的旧结果被写回缓存
+        self._tools_lock = asyncio.Lock()
+        self.list_tools_requests = 0
+        self.list_tools_fetches = 0
+        self.invalidations = 0
+        self.connects = 0
+
+    # ---------- 生命周期 ----------
+    async def start(self):
+        if self._keeper is None:
+            self._keeper = asyncio.create_task(self._keep_session())
+        try:
+            await asyncio.wait_for(self._ready.wait(), self.timeout)
+        except asyncio.TimeoutError:
+            print(f"[MCP] {self.url} 暂时连不上，后台会继续重试")
+
+    async def stop(self):
+        keeper, self._keeper = self._keeper, None
+        if keeper is not None:
+            keeper.cancel()
+            try:
+                await keeper
+            except asyncio.CancelledError:
+                pass
+
+    async def _keep_session(self):
+        while True:
+            closed = self._session_closed = asyncio.Event()
+            try:
+                async with AsyncExitStack() as stack:
+                    read_stream, write_stream = await stack.enter_async_context(self.client_streams())
+                    client = ClientSession(
+                        read_stream=read_stream,
+                        write_stream=write_stream,
+                        sampling_callback=self._sampling_callback if self.allow_sampling else None,
+                        logging_callback=self.log_handler,
+                        message_handler=self._on_message,
+                        read_timeout_seconds=timedelta(seconds=self.read_timeout),
+                    )
+                    self._client = await stack.enter_async_context(client)
+                    await asyncio.wait_for(self._client.initialize(), self.timeout)
+                    if self.log_level:
+                        await self._client.set_logging_level(self.log_level)
+                    self._tools = None  # 新会话，服务端可能已经换了工具
+                    self._tools_version += 1
+                    self.connects += 1
+                    self._ready.set()
+                    print(f"[MCP] 已连接 {self.url}")
+                    await self._broken.wait()
+                    print(f"[MCP] 会话异常，正在重连 {self.url}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[MCP] 连接失败：{e}，{MCP_RETRY_INTERVAL}秒后重试")
+                await asyncio.sleep(MCP_RETRY_INTERVAL)
+            finally:
+                self._ready.clear()
+                self._broken.clear()
+                closed.set()
+
+    async def __aenter__(self):
+        if self._keeper is None:
+            return await super().__aenter__()
+        await asyncio.wait_for(self._ready.wait(), self.timeout)
+        return self
+
+    async def __aexit__(self, *args):
+        if self._keeper is None:
+            return await super().__aexit__(*args)
+
+    async def _guarded(self, coro, closed: asyncio.Event):
+        """会话中途断开时，旧会话上还没返回的请求不会自己结束（要等到read_timeout），这里主动取消"""
+        task = asyncio.ensure_future(coro)
+        waiter = asyncio.ensure_future(closed.wait())
+        try:
+            await asyncio.wait({task, waiter}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            waiter.cancel()
+            if not task.done():
+                task.cancel()
+        if task.done() and not task.cancelled():
+            return task.result()
+        raise ConnectionError("MCP会话已断开，正在重连")
+
+    def _mark_broken(self, closed: asyncio.Event):
+        if self._session_closed is closed:  # 只处理当前会话，避免把刚重连好的新会话也关掉
+            self._broken.set()
+
+    @property
+    def is_running(self) -> bool:
+        return self._ready.is_set() if self._keeper is not None else super().is_running
+
+    # ---------- 工具列表缓存 ----------
+    async def _on_message(self, message):
+        if isinstance(message, mcp_types.ServerNotification) and \
+                isinstance(message.root, mcp_types.ToolListChangedNotification):
+            print("[MCP] 服务端工具列表已变化，缓存失效")
+            self.invalidate_tools()
+
+    def invalidate_tools(self):
+        self._tools = None
+        self._tools_version += 1
+        self.invalidations += 1
+
+    async def list_tools(self) -> list[mcp_types.Tool]:
+        self.list_tools_requests += 1
+        if self._keeper is None:  # 没有长连接就收不到变更通知，不缓存
+            return await super().list_tools()
+        async with self._tools_lock:  # 并发的未命中只拉取一次
+            if self._tools is None:
+                version = self._tools_version
+                async with self:
+                    closed = self._session_closed
+                    try:
+                        result = await self._guarded(self._client.list_tools(), closed)
+                    except McpError:
+                        raise
+                    except Exception:
+                        self._mark_broken(closed)
+                        raise
+                self.list_tools_fetches += 1
+                if version == self._tools_version:
+                    self._tools = result.tools
+                return result.tools
+            return self._tools
+
+    async def direct_call_tool(self, name, args, metadata=None):
+        if self._keeper is None:
+            return await super().direct_call_tool(name, args, metadata)
+        async with self:
+            closed = self._session_closed
+            try:
+                return await self._guarded(super().direct_call_tool(name, args, metadata), closed)
+            except ModelRetry:
+                raise
+            except Exception as e:
+                self._mark_broken(closed)  # 传输层出错，让后台任务重建会话
+                raise ModelRetry(f"MCP调用失败：{e}，请重试") from e
+
+    def stats(self) -> dict:
+        return {
+            "connected": self.is_running,
+            "connects": self.connects,
+            "tools_cached": self._tools is not None,
+            "list_tools_requests": self.list_tools_requests,
+            "list_tools_fetches": self.list_tools_fetches,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,104 @@
+import asyncio
+import time
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager, contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from pydantic_ai.models import StreamedResponse
+from pydantic_ai.models.wrapper import WrapperModel
+from pydantic_ai.usage import Usage
+
+# ================== Prometheus指标 ==================
+# 请求内各阶段（意图判断、divider、联网搜索、指令执行、writer、agent流式输出……）的耗时分布、
+# 首字节时间、LLM token用量和在途请求数，通过 /metrics 暴露给 Prometheus，p99 变差时能定位到具体阶段
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+REQUESTS = Counter("agui_requests_total", "AG-UI请求数", ["status"])
+REQUESTS_IN_FLIGHT = Gauge("agui_requests_in_flight", "正在处理的AG-UI请求数")
+REQUEST_SECONDS = Histogram("agui_request_seconds", "AG-UI请求从开始到SSE流结束的耗时", buckets=LATENCY_BUCKETS)
+FIRST_BYTE_SECONDS = Histogram("agui_time_to_first_byte_seconds", "收到请求到发出第一个SSE事件的耗时", buckets=LATENCY_BUCKETS)
+FIRST_TEXT_SECONDS = Histogram("agui_time_to_first_text_seconds", "收到请求到发出第一段回复文本的耗时", buckets=LATENCY_BUCKETS)
+STAGE_SECONDS = Histogram("agui_stage_seconds", "请求内各阶段耗时", ["stage"], buckets=LATENCY_BUCKETS)
+STAGES_IN_FLIGHT = Gauge("agui_stages_in_flight", "正在执行的阶段数", ["stage"])
+
+LLM_REQUESTS = Counter("llm_requests_total", "LLM请求数（含缓存命中）", ["agent"])
+LLM_REQUESTS_IN_FLIGHT = Gauge("llm_requests_in_flight", "正在进行的LLM请求数", ["agent"])
+LLM_SECONDS = Histogram("llm_request_seconds", "单次LLM请求耗时（流式请求到流读完为止）", ["agent"], buckets=LATENCY_BUCKETS)
+LLM_TOKENS = Counter("llm_tokens_total", "LLM token用量，来自 pydantic_ai usage", ["agent", "kind"])
+
+@contextmanager
+def stage(name: str):
+    """统计一个阶段的耗时；在 async 代码里包住 await 即可"""
+    STAGES_IN_FLIGHT.labels(name).inc()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(name).observe(time.perf_counter() - start)
+        STAGES_IN_FLIGHT.labels(name).dec()
+
+def record_usage(agent: str, usage: Usage):
+    LLM_TOKENS.labels(agent, "request").inc(usage.request_tokens or 0)
+    LLM_TOKENS.labels(agent, "response").inc(usage.response_tokens or 0)
+
+async def track_stream(chunks: AsyncIterator[str], start: float) -> AsyncIterator[str]:
+    """包住整个SSE事件流：首字节、首段文本、总耗时、在途请求数和结束状态"""
+    REQUESTS_IN_FLIGHT.inc()
+    first_byte = first_text = run_error = False
+    status = "error"
+    try:
+        async for chunk in chunks:
+            if not first_byte:
+                first_byte = True
+                FIRST_BYTE_SECONDS.observe(time.perf_counter() - start)
+            if not first_text and '"TEXT_MESSAGE_CONTENT"' in chunk:
+                first_text = True
+                FIRST_TEXT_SECONDS.observe(time.perf_counter() - start)
+            if '"RUN_ERROR"' in chunk:
+                run_error = True  # 出错时事件流以RUN_ERROR正常结束，按error计
+            yield chunk
+        status = "error" if run_error else "ok"
+    except (GeneratorExit, asyncio.CancelledError):
+        status = "disconnected"  # 客户端提前断开
+        raise
+    finally:
+        REQUESTS.labels(status).inc()
+        REQUEST_SECONDS.observe(time.perf_counter() - start)
+        REQUESTS_IN_FLIGHT.dec()
+
+def render() -> tuple[bytes, str]:
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+# ================== LLM请求计量 ==================
+class MeteredModel(WrapperModel):
+    """按agent名记录每次LLM请求的耗时和token用量；缓存命中的 usage 为空，不计入token"""
+    def __init__(self, wrapped, agent: str):
+        super().__init__(wrapped)
+        self.agent = agent
+
+    async def request(self, *args, **kwargs):
+        LLM_REQUESTS.labels(self.agent).inc()
+        LLM_REQUESTS_IN_FLIGHT.labels(self.agent).inc()
+        start = time.perf_counter()
+        try:
+            response = await self.wrapped.request(*args, **kwargs)
+        finally:
+            LLM_SECONDS.labels(self.agent).observe(time.perf_counter() - start)
+            LLM_REQUESTS_IN_FLIGHT.labels(self.agent).dec()
+        record_usage(self.agent, response.usage)
+        return response
+
+    @asynccontextmanager
+    async def request_stream(self, messages, model_settings, model_request_parameters) -> AsyncIterator[StreamedResponse]:
+        LLM_REQUESTS.labels(self.agent).inc()
+        LLM_REQUESTS_IN_FLIGHT.labels(self.agent).inc()
+        start = time.perf_counter()
+        try:
+            async with self.wrapped.request_stream(messages, model_settings, model_request_parameters) as stream:
+                try:
+                    yield stream
+                finally:
+                    record_usage(self.agent, stream.usage())
+        finally:
+            LLM_SECONDS.labels(self.agent).observe(time.perf_counter() - start)
+            LLM_REQUESTS_IN_FLIGHT.labels(self.agent).dec()
@@ -0,0 +1,213 @@
+import hashlib
+import os
+import json
+import numpy as np
+
+# ================== 检索后端 ==================
+# 所有后端实现同一组方法：ids / upsert / delete / flush / query，embeding.py 只依赖这组接口
+def ids_version(ids) -> str:
+    """chunk id由内容生成，id集合不变内容就不变，因此id集合的hash可以作为索引内容的版本号"""
+    return hashlib.sha256("\n".join(sorted(ids)).encode("utf-8")).hexdigest()
+
+class VectorIndex:
+    def ids(self) -> set[str]:
+        raise NotImplementedError
+
+    def version(self) -> str:
+        """索引内容的版本号，其他进程（如 python embeding.py --watch）改写了同一个库时也会变化"""
+        return ids_version(self.ids())
+
+    def items(self) -> tuple[list[str], list[str]]:
+        """返回全部(ids, documents)，供BM25等本地索引建库"""
+        raise NotImplementedError
+
+    def upsert(self, ids: list[str], documents: list[str], embeddings: list[list[float]], metadatas: list[dict]):
+        raise NotImplementedError
+
+    def delete(self, ids: list[str]):
+        raise NotImplementedError
+
+    def flush(self):
+        """把缓冲的写入落盘，默认无需处理"""
+
+    def query(self, embedding: list[float], n_results: int = 5) -> list[str]:
+        raise NotImplementedError
+
+class ChromaIndex(VectorIndex):
+    def __init__(self, path: str = "./chroma.db", collection: str = "nameoftable"):
+        import chromadb
+        self.client = chromadb.PersistentClient(path)
+        self.collection = self.client.get_or_create_collection(collection)
+
+    def ids(self) -> set[str]:
+        return set(self.collection.get(include=[])["ids"])
+
+    def items(self):
+        results = self.collection.get(include=["documents"])
+        return results["ids"], results["documents"]
+
+    def upsert(self, ids, documents, embeddings, metadatas):
+        self.collection.upsert(ids=ids, documents=documents, embeddings=embeddings, metadatas=metadatas)
+
+    def delete(self, ids):
+        self.collection.delete(ids=ids)
+
+    def query(self, embedding, n_results=5):
+        results = self.collection.query(query_embeddings=embedding, n_results=n_results)
+        return results["documents"][0]
+
+class NumpyIndex(VectorIndex):
+    """进程内向量索引：向量归一化后存成一个连续矩阵（.npy内存映射），查询时暴力点积 + argpartition取top-k
+
+    dtype 可选 float32 / float16 / int8（int8按行存缩放系数）；dim 不为空时截断到前dim维再归一化，
+    和 gemini 的 output_dimensionality 效果一致，用来进一步降低内存和扫描开销
+    """
+    DTYPES = ("float32", "float16", "int8")
+    SCAN_BLOCK = 65536  # 分块扫描，避免int8/float16一次性转成float32占用大量内存
+
+    def __init__(self, path: str = "./numpy_index", dtype: str = "float32", dim: int | None = None):
+        if dtype not in self.DTYPES:
+            raise ValueError(f"不支持的dtype: {dtype}，可选 {self.DTYPES}")
+        self.path = path
+        self.dtype = dtype
+        self.dim = dim
+        self._dirty = False
+        self._load()
+
+    # ---------- 持久化 ----------
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _mtime(self) -> int | None:
+        try:
+            return os.stat(self._file("docs.json")).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _load(self):
+        self._matrix = None
+        self._scales = None
+        self._ids, self._documents, self._metadatas = [], [], []
+        self._pos = {}
+        self._loaded_mtime = self._mtime()
+        if self._loaded_mtime is None:
+            return
+        with open(self._file("docs.json"), "r", encoding="utf-8") as f:
+            docs = json.load(f)
+        if docs.get("dtype") != self.dtype or docs.get("dim") != self.dim:
+            print(f"NumpyIndex 配置变化（{docs.get('dtype')}/{docs.get('dim')} -> {self.dtype}/{self.dim}），需要重新建库")
+            return
+        self._ids, self._documents, self._metadatas = docs["ids"], docs["documents"], docs["metadatas"]
+        if self._ids:
+            self._matrix = np.load(self._file("vectors.npy"), mmap_mode="r")
+            if self.dtype == "int8":
+                self._scales = np.load(self._file("scales.npy"))
+        self._pos = {cid: i for i, cid in enumerate(self._ids)}
+
+    def _save(self):
+        os.makedirs(self.path, exist_ok=True)
+        matrix = np.asarray(self._matrix) if self._matrix is not None else None
+        self._matrix = None  # 先释放旧的内存映射，Windows下否则无法覆盖文件
+        if matrix is not None:
+            np.save(self._file("vectors.tmp.npy"), matrix)
+            os.replace(self._file("vectors.tmp.npy"), self._file("vectors.npy"))
+            if self._scales is not None:
+                np.save(self._file("scales.npy"), self._scales)
+        docs = {"dtype": self.dtype, "dim": self.dim, "ids": self._ids,
+                "documents": self._documents, "metadatas": self._metadatas}
+        with open(self._file("docs.tmp.json"), "w", encoding="utf-8") as f:
+            json.dump(docs, f, ensure_ascii=False)
+        os.replace(self._file("docs.tmp.json"), self._file("docs.json"))
+        self._load()
+
+    # ---------- 向量处理 ----------
+    def _normalize(self, vectors) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.dim:
+            vectors = vectors[..., :self.dim]
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def _quantize(self, vectors: np.ndarray):
+        if self.dtype == "int8":
+            scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+            return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+        return vectors.astype(self.dtype), None
+
+    def _refresh(self):
+        """其他进程（python embeding.py / --watch）重新建库后 docs.json 会被替换，按修改时间重新加载；
+        本进程还有没落盘的写入时不重新加载"""
+        if not self._dirty and self._mtime() != self._loaded_mtime:
+            print(f"NumpyIndex {self.path} 已被更新，重新加载")
+            self._load()
+
+    # ---------- 接口实现 ----------
+    def version(self) -> str:
+        self._refresh()
+        return str(self._loaded_mtime)
+
+    def ids(self) -> set[str]:
+        self._refresh()
+        return set(self._ids)
+
+    def items(self):
+        self._refresh()
+        return list(self._ids), list(self._documents)
+
+    def upsert(self, ids, documents, embeddings, metadatas):
+        self.delete([cid for cid in ids if cid in self._pos])
+        rows, scales = self._quantize(self._normalize(embeddings))
+        if self._matrix is None or len(self._matrix) == 0:
+            self._matrix, self._scales = rows, scales
+        else:
+            self._matrix = np.concatenate([np.asarray(self._matrix), rows])
+            if scales is not None:
+                self._scales = np.concatenate([self._scales, scales])
+        start = len(self._ids)
+        self._ids = self._ids + list(ids)
+        self._documents = self._documents + list(documents)
+        self._metadatas = self._metadatas + list(metadatas)
+        self._pos.update({cid: start + i for i, cid in enumerate(ids)})
+        self._dirty = True
+
+    def delete(self, ids):
+        drop = {self._pos[cid] for cid in ids if cid in self._pos}
+        if not drop:
+            return
+        keep = np.array([i for i in range(len(self._ids)) if i not in drop], dtype=np.int64)
+        self._matrix = np.asarray(self._matrix)[keep]
+        if self._scales is not None:
+            self._scales = self._scales[keep]
+        self._ids = [self._ids[i] for i in keep]
+        self._documents = [self._documents[i] for i in keep]
+        self._metadatas = [self._metadatas[i] for i in keep]
+        self._pos = {cid: i for i, cid in enumerate(self._ids)}
+        self._dirty = True
+
+    def flush(self):
+        if self._dirty:
+            self._save()
+            self._dirty = False
+
+    def query(self, embedding, n_results=5):
+        self._refresh()
+        if self._matrix is None or len(self._ids) == 0:
+            return []
+        q = self._normalize(embedding)
+        scores = np.empty(len(self._ids), dtype=np.float32)
+        for start in range(0, len(scores), self.SCAN_BLOCK):
+            block = self._matrix[start:start + self.SCAN_BLOCK]
+            scores[start:start + len(block)] = block.astype(np.float32, copy=False) @ q
+        if self._scales is not None:
+            scores *= self._scales
+        k = min(n_results, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [self._documents[i] for i in top]
+
+def make_index(backend: str = "chroma", **kwargs) -> VectorIndex:
+    if backend == "chroma":
+        return ChromaIndex(**kwargs)
+    if backend == "numpy":
+        return NumpyIndex(**kwargs)
+    raise ValueError(f"未知的检索后端: {backend}")
@@ -2,13 +2,14 @@ from fastapi import FastAPI
 from ag_ui.core import RunAgentInput
 from http import HTTPStatus
 from pydantic_ai.ag_ui import run_ag_ui, SSE_CONTENT_TYPE
-from pydantic_ai.models.openai import OpenAIModel
-from pydantic_ai.providers.openai import OpenAIProvider
 from pydantic_ai import Agent
 from pydantic import ValidationError
-import os
 import json
 from dotenv import load_dotenv
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "demo"))  # llm_provider 等共享模块在 demo/ 下
+import llm_provider
 from fastapi.requests import Request
 from fastapi.responses import Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
@@ -16,12 +17,7 @@ from fastapi.middleware.cors import CORSMiddleware
 load_dotenv()
 
 
-deepseek_provider = OpenAIProvider(api_key=os.getenv("DEEPSEEK_API_KEY"),
-                                   base_url="https://api.deepseek.com/v1")
-deepseek_model = OpenAIModel(
-    model_name = "deepseek-chat",
-    provider = deepseek_provider
-)
+deepseek_model = llm_provider.deepseek_model()
 
 agent = Agent(model=deepseek_model,
               system_prompt = "你是一个智能助手"
@@ -1,9 +1,10 @@
 from pydantic import BaseModel
 from pydantic_ai import Agent
-from pydantic_ai.models.openai import OpenAIModel
-from pydantic_ai.providers.openai import OpenAIProvider
-import os
 from dotenv import load_dotenv
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "demo"))  # llm_provider 等共享模块在 demo/ 下
+import llm_provider
 
 load_dotenv()
 
@@ -11,12 +12,7 @@ class Answer(BaseModel):
     text: str
     confidence: float
 
-deepseek_provider = OpenAIProvider(api_key=os.getenv("DEEPSEEK_API_KEY"),
-                                   base_url="https://api.deepseek.com/v1")
-deepseek_model = OpenAIModel(
-    model_name = "deepseek-chat",
-    provider = deepseek_provider
-)
+deepseek_model = llm_provider.deepseek_model()
 
 agent = Agent(model=deepseek_model,
               system_prompt = "你是一个娇羞的女仆，用户是你的主人，一切回答都以为'主人'开头,一定要突出娇羞可爱的二次元风格",
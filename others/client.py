@@ -1,9 +1,10 @@
 from pydantic_ai import Agent
 from pydantic_ai.mcp import MCPServerStreamableHTTP
-from pydantic_ai.models.openai import OpenAIModel
-from pydantic_ai.providers.openai import OpenAIProvider
-import os
 from dotenv import load_dotenv
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "demo"))  # llm_provider 等共享模块在 demo/ 下
+import llm_provider
 import asyncio
 # import logfire
 
@@ -11,12 +12,7 @@ load_dotenv()
 # logfire.configure()
 # logfire.instrument_pydantic_ai()
 
-deepseek_provider = OpenAIProvider(api_key=os.getenv("DEEPSEEK_API_KEY"),
-                                   base_url="https://api.deepseek.com/v1")
-deepseek_model = OpenAIModel(
-    model_name = "deepseek-chat",
-    provider = deepseek_provider
-)
+deepseek_model = llm_provider.deepseek_model()
 
 server = MCPServerStreamableHTTP('http://127.0.0.1:9800/dodo')
 
@@ -1,9 +1,10 @@
 from pydantic import BaseModel,Field
 from pydantic_ai import Agent,RunContext
-from pydantic_ai.models.openai import OpenAIModel
-from pydantic_ai.providers.openai import OpenAIProvider
-import os
 from dotenv import load_dotenv
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "demo"))  # llm_provider 等共享模块在 demo/ 下
+import llm_provider
 
 load_dotenv()
 
@@ -16,12 +17,7 @@ class Student(BaseModel):
     name: str = Field(description="学生姓名")
     age: int = Field(description="学生年龄")
     
-deepseek_provider = OpenAIProvider(api_key=os.getenv("DEEPSEEK_API_KEY"),
-                                   base_url="https://api.deepseek.com/v1")
-deepseek_model = OpenAIModel(
-    model_name = "deepseek-chat",
-    provider = deepseek_provider
-)
+deepseek_model = llm_provider.deepseek_model()
 
 def check_customer(ctx: RunContext[Student]) -> str:
     student = ctx.deps
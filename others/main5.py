@@ -1,9 +1,11 @@
 from pydantic import BaseModel, Field
 from pydantic_ai import Agent, RunContext
-from pydantic_ai.models.openai import OpenAIModel
-from pydantic_ai.providers.openai import OpenAIProvider
 import os
 from dotenv import load_dotenv
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "demo"))  # llm_provider 等共享模块在 demo/ 下
+import llm_provider
 import subprocess
 from typing import List
 
@@ -29,12 +31,7 @@ class OperatorResponse(BaseModel):
     success: bool = Field(description="操作是否成功")
 
 # ================== 模型配置 ==================
-deepseek_provider = OpenAIProvider(api_key=os.getenv("DEEPSEEK_API_KEY"),
-                                   base_url="https://api.deepseek.com/v1")
-deepseek_model = OpenAIModel(
-    model_name="deepseek-chat",
-    provider=deepseek_provider
-)
+deepseek_model = llm_provider.deepseek_model()
 
 # ================== Operator 工具方法 ==================
 def make_file(ctx: RunContext[FileInfo]) -> str:
@@ -1,9 +1,10 @@
 from pydantic_ai import Agent, RunContext
-from pydantic_ai.models.openai import OpenAIModel
-from pydantic_ai.providers.openai import OpenAIProvider
 from pydantic import BaseModel, Field
-import os
 from dotenv import load_dotenv
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "demo"))  # llm_provider 等共享模块在 demo/ 下
+import llm_provider
 import embeding
 
 load_dotenv()
@@ -11,12 +12,7 @@ load_dotenv()
 class Question(BaseModel):
     question: str = Field(..., description="知识库指示词")
 
-deepseek_provider = OpenAIProvider(api_key=os.getenv("DEEPSEEK_API_KEY"),
-                                   base_url="https://api.deepseek.com/v1")
-deepseek_model = OpenAIModel(
-    model_name = "deepseek-chat",
-    provider = deepseek_provider
-)
+deepseek_model = llm_provider.deepseek_model()
 agent = Agent(
     model=deepseek_model,
     system_prompt = "你是一个智能助手",
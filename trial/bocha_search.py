@@ -14,7 +14,8 @@ async def search_bocha(query):
         'Content-Type': 'application/json'
     }
 
-    response = requests.request("POST", url, headers=headers, data=payload)
+    # requests是阻塞调用，放到线程里执行，避免卡住事件循环
+    response = await asyncio.to_thread(requests.request, "POST", url, headers=headers, data=payload)
     data =  response.json()
     results = []
     for item in data.get('data', {}).get('webPages', {}).get('value', []):